@@ -7,7 +7,13 @@ Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
 # load libraries
 import pandas as pd
 import numpy as np
+import pyarrow.feather as feather
+import hashlib
+import glob
+import os
+import re
 import itertools
+from types import MappingProxyType
 from sklearn.impute import SimpleImputer
 import utility as u
 import config_operation as co
@@ -27,11 +33,14 @@ class D:
     del_white_space_col(inplace):
         Renames DataFrame columns by removing leading and trailing whitespace.
 
+    load_snapshot(file_path, encode, cache_dir):
+        Returns the cleaned DataFrame from a content-hashed Arrow snapshot, writing it on first load.
+
     get_questions_as_df():
         Returns a DataFrame containing the column names (excluding the first column) as questions.
     """
      
-    def __init__(self,file_path,encode):
+    def __init__(self,file_path,encode,cache_dir = None,usecols = None):
 
         """
         Initializes the D object by loading data from a CSV file into a pandas DataFrame.
@@ -42,9 +51,16 @@ class D:
             The file path to the CSV file to be loaded.
         encode : str
             The encoding of the CSV file.
+        cache_dir : str, optional
+            A directory for Arrow snapshots of the cleaned DataFrame. If None (default), the CSV file is parsed every time.
+        usecols : list, optional
+            The column positions to be loaded. If None (default), all the columns are loaded.
         """
 
-        self.df = pd.read_csv(file_path,encoding = encode)
+        if cache_dir is None:
+            self.df = pd.read_csv(file_path,encoding = encode,usecols = usecols)
+        else:
+            self.df = D.load_snapshot(file_path,encode,cache_dir,usecols)
 
     def del_white_space_col(self, inplace):
 
@@ -71,18 +87,237 @@ class D:
         else:
     
             return self.df.rename(columns = dict(zip(self.df.columns,[c.strip() for c in self.df.columns])))
+
+    @staticmethod
+    def file_fingerprint(file_path,encode):
+
+        """
+        Computes a SHA-256 digest of the bytes of a file together with its encoding.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to hash.
+        encode : str
+            The encoding used to parse the file.
+
+        Returns:
+        --------
+        str
+            The hexadecimal digest.
+        """
+
+        digest = hashlib.sha256(encode.encode())
+
+        with open(file_path,'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def load_snapshot(file_path,encode,cache_dir,usecols = None):
+
+        """
+        Returns the cleaned DataFrame of a CSV file from a content-hashed Arrow (Feather) snapshot.
+        The snapshot is written on the first load and memory-mapped on later loads.
+        It is invalidated whenever the bytes of the CSV file change.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the CSV file to be loaded.
+        encode : str
+            The encoding of the CSV file.
+        cache_dir : str
+            The directory in which the snapshots are stored.
+        usecols : list, optional
+            The column positions to be loaded. Each projection has its own snapshot.
+
+        Returns:
+        --------
+        DataFrame
+            The DataFrame whose column names have no leading and trailing whitespace.
+        """
+
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        fingerprint = D.file_fingerprint(file_path,encode)
+        projection = hashlib.sha256(str(usecols).encode()).hexdigest()
+        snapshot_path = os.path.join(cache_dir,'{}_{}_{}.feather'.format(stem,fingerprint[:16],projection[:8]))
+
+        if os.path.exists(snapshot_path):
+
+            df = feather.read_table(snapshot_path,memory_map = True).to_pandas()
+
+            # Arrow restores missing strings as None, whereas read_csv gives NaN
+            object_cols = df.columns[df.dtypes == object]
+            df[object_cols] = df[object_cols].fillna(np.nan)
+
+            return df
+
+        df = pd.read_csv(file_path,encoding = encode,usecols = usecols)
+        df = df.rename(columns = dict(zip(df.columns,[c.strip() for c in df.columns])))
+
+        os.makedirs(cache_dir,exist_ok = True)
+
+        # drop the snapshots taken from the former bytes of the same file, not those of other files whose names start with the same stem
+        snapshot_name = re.compile(re.escape(stem) + r'_([0-9a-f]{16})_[0-9a-f]{8}\.feather')
+
+        for stale_path in glob.glob(os.path.join(cache_dir,'{}_*.feather'.format(glob.escape(stem)))):
+            matched = snapshot_name.fullmatch(os.path.basename(stale_path))
+            if matched is not None and matched.group(1) != fingerprint[:16]:
+                os.remove(stale_path)
+
+        # write to a temporary file first so that a concurrent reader never maps a half-written snapshot
+        temp_path = '{}.{}.tmp'.format(snapshot_path,os.getpid())
+        feather.write_feather(df,temp_path,compression = 'uncompressed')
+
+        try:
+            os.replace(temp_path,snapshot_path)
+        except OSError:
+            os.remove(temp_path)
+            if not os.path.exists(snapshot_path): # another process has not written it either
+                raise
+
+        return df
     
     @staticmethod
     def replacement(df,replace_dict):
 
-        df_copy = df.copy()
+        """
+        Replaces the Likert scale answers with their scores. See replace_likert() for the details.
 
-        for c in df_copy.columns:
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to be replaced.
+        replace_dict : dict
+            The mapping from answers to scores, e.g. scales.yaml.
+
+        Returns:
+        --------
+        DataFrame
+            A copy of the DataFrame with the scores.
+        """
+
+        df_copy, _ = D.replace_likert(df,replace_dict)
 
-            df_copy.loc[:,c].replace(replace_dict,inplace = True)
-        
         return df_copy
 
+    @staticmethod
+    def replace_likert(df,replace_dict):
+
+        """
+        Replaces the answers of all the qualified columns in a single vectorized pass.
+        The values of the whole object block are factorized once, the mapping is applied to the unique values only,
+        and the codes are taken back into the frame. Categorical columns are replaced through their category table.
+        A column whose answers are all replaced is converted to numbers, i.e. it is ordinal-encoded.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to be replaced.
+        replace_dict : dict
+            The mapping from answers to scores, e.g. scales.yaml.
+
+        Returns:
+        --------
+        tuple
+            A copy of the DataFrame with the scores, and a report dictionary listing the 'ordinal' columns
+            (all answers replaced) and the 'partial' columns (some answers replaced).
+        """
+
+        df_copy = df.copy()
+        report = {'ordinal':[], 'partial':[]}
+
+        object_cols = [c for c in df_copy.columns if df_copy.loc[:,c].dtype == object]
+        categorical_cols = [c for c in df_copy.columns if isinstance(df_copy.loc[:,c].dtype, pd.CategoricalDtype)]
+
+        replaced_cols = {}
+
+        if len(object_cols) > 0:
+
+            block = df_copy.loc[:,object_cols].to_numpy()
+            codes, uniques = pd.factorize(block.ravel())
+            codes = codes.reshape(block.shape)
+
+            is_mapped = np.array([uv in replace_dict for uv in uniques], dtype = bool)
+            mapped_uniques = np.array([replace_dict.get(uv, uv) for uv in uniques] + [np.nan], dtype = object)
+
+            # code -1 (missing value) picks up the trailing NaN
+            replaced_block = mapped_uniques[codes]
+            mapped_block = np.append(is_mapped, False)[codes]
+            missing_block = codes < 0
+
+            for idx, c in enumerate(object_cols):
+                replaced_cols[c] = (replaced_block[:,idx], mapped_block[:,idx], missing_block[:,idx])
+
+        for c in categorical_cols:
+
+            arr = df_copy.loc[:,c]
+            categories = arr.cat.categories
+            codes = arr.cat.codes.values
+
+            is_mapped = np.array([uv in replace_dict for uv in categories] + [False], dtype = bool)
+            mapped_categories = np.array([replace_dict.get(uv, uv) for uv in categories] + [np.nan], dtype = object)
+
+            replaced_cols[c] = (mapped_categories[codes], is_mapped[codes], codes < 0)
+
+        for c, (values, mapped, missing) in replaced_cols.items():
+
+            if mapped.any() == False:
+                continue
+
+            if (mapped | missing).all():
+                df_copy[c] = pd.Series(values, index = df_copy.index).infer_objects()
+                report['ordinal'].append(c)
+            else:
+                df_copy[c] = pd.Series(values, index = df_copy.index, dtype = object)
+                report['partial'].append(c)
+
+        return df_copy, report
+
+    @staticmethod
+    def encode_qualified(df):
+
+        """
+        Encodes each qualified column once into integer codes with a per-column category table.
+        pandas stores the codes as int8 (up to 127 categories) or int16, and the stats layer operates on them.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to encode.
+
+        Returns:
+        --------
+        DataFrame
+            A copy of the DataFrame whose qualified columns have the categorical dtype.
+        """
+
+        qualified_cols = [c for c in df.columns if u.istype(df.loc[:,c]) == 'qualified']
+
+        return df.astype(dict.fromkeys(qualified_cols,'category'))
+
+    @staticmethod
+    def get_category_table(df):
+
+        """
+        Returns the category table of every encoded column.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame encoded with encode_qualified().
+
+        Returns:
+        --------
+        dict
+            A dictionary mapping each categorical column to the list of its categories. The position of a category is its code.
+        """
+
+        return {c: df.loc[:,c].cat.categories.tolist() for c in df.columns if isinstance(df.loc[:,c].dtype, pd.CategoricalDtype)}
+
     @staticmethod
     def compute_missing_ratio(arr):
         populations = len(arr)
@@ -139,20 +374,159 @@ class D:
         return arr_imputed
 
     @staticmethod
-    def main_impute(df,missing_allowance,fill_qualified_constant_value):
+    def impute_statistics(df,missing_allowance,fill_qualified_constant_value):
+
+        """
+        Computes the imputation strategy and fill value of every column in one vectorized pass.
+        The strategies are the same as the ones chosen by missing_impute().
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to be imputed.
+        missing_allowance : float
+            The missing ratio up to which the most frequent value (qualified) or the mean (quantified) is used.
+        fill_qualified_constant_value : str
+            The constant for the qualified columns whose missing ratio exceeds missing_allowance.
+
+        Returns:
+        --------
+        DataFrame
+            A DataFrame indexed by column with 'type', 'missing_ratio', 'outlier_ratio', 'strategy' and 'fill_value'.
+        """
+
+        types = pd.Series([u.istype(df.loc[:,c]) for c in df.columns], index = df.columns)
+        qualified_cols = types.index[types == 'qualified']
+        quantified_cols = types.index[types == 'quantified']
+
+        missing_ratio = df.isna().sum() / len(df)
+
+        statistics = pd.DataFrame({'type':types, 'missing_ratio':missing_ratio, 'outlier_ratio':np.nan, 'strategy':None, 'fill_value':None}, index = df.columns)
+
+        if len(quantified_cols) > 0:
+
+            quantified = df.loc[:,quantified_cols]
+            mean = quantified.mean()
+            std = quantified.std(ddof = 0)
+
+            outliers = (quantified < mean - 3 * std) | (quantified > mean + 3 * std)
+            outlier_ratio = outliers.sum() / len(df)
+
+            use_median = (missing_ratio[quantified_cols] > missing_allowance) & (outlier_ratio >= .003) # 0.3%
+
+            statistics.loc[quantified_cols,'outlier_ratio'] = outlier_ratio
+            statistics.loc[quantified_cols,'strategy'] = np.where(use_median, 'median', 'mean')
+            statistics.loc[quantified_cols,'fill_value'] = np.where(use_median, quantified.median(), mean)
+
+        if len(qualified_cols) > 0:
+
+            # count every value of the qualified block at once
+            block = df.loc[:,qualified_cols].to_numpy()
+            codes, uniques = pd.factorize(block.ravel())
+            codes = codes.reshape(block.shape)
+
+            col_idx = np.broadcast_to(np.arange(len(qualified_cols)), codes.shape)
+            valid = codes >= 0
+            counts = np.bincount(col_idx[valid] * len(uniques) + codes[valid], minlength = len(qualified_cols) * len(uniques))
+            counts = counts.reshape(len(qualified_cols), len(uniques))
+
+            # SimpleImputer breaks ties by the smallest value
+            rank = np.empty(len(uniques), dtype = np.int64)
+            rank[np.argsort(uniques)] = np.arange(len(uniques))
+            is_mode = (counts == counts.max(axis = 1, keepdims = True)) & (counts > 0)
+            most_frequent = uniques[np.argmin(np.where(is_mode, rank, len(uniques)), axis = 1)] if len(uniques) > 0 else np.full(len(qualified_cols), np.nan)
+
+            use_constant = missing_ratio[qualified_cols] > missing_allowance
+
+            statistics.loc[qualified_cols,'strategy'] = np.where(use_constant, 'constant', 'most_frequent')
+            statistics.loc[qualified_cols,'fill_value'] = pd.Series(np.where(use_constant, fill_qualified_constant_value, most_frequent), index = qualified_cols, dtype = object)
+
+        return statistics
+
+    @staticmethod
+    def apply_impute(df,statistics):
+
+        """
+        Fills the missing values with the fill values of impute_statistics() without a per-column fit/transform round trip.
+        The quantified columns imputed with the mean or median are rounded as in missing_impute().
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to be imputed.
+        statistics : DataFrame
+            The result of impute_statistics().
+
+        Returns:
+        --------
+        DataFrame
+            A copy of the DataFrame without missing values.
+        """
 
         df_copy = df.copy()
 
-        for c in df_copy.columns:
+        statistics = statistics.loc[statistics.index.isin(df_copy.columns)]
+        fill_values = statistics.loc[df_copy.loc[:,statistics.index].isna().any().values,'fill_value'].dropna()
 
-            arr = df_copy.loc[:,c]
+        for c in fill_values.index:
+            if isinstance(df_copy.loc[:,c].dtype, pd.CategoricalDtype) and fill_values[c] not in df_copy.loc[:,c].cat.categories:
+                df_copy[c] = df_copy.loc[:,c].cat.add_categories([fill_values[c]])
 
-            arr_imputed = D.missing_impute(arr,missing_allowance,fill_qualified_constant_value)
+        df_copy = df_copy.fillna(fill_values.to_dict())
 
-            df_copy.loc[:,c] = arr_imputed
+        rounded_cols = statistics.index[statistics['strategy'].isin(['mean','median'])]
+        df_copy[rounded_cols] = df_copy.loc[:,rounded_cols].round(0)
 
         return df_copy
 
+    @staticmethod
+    def main_impute(df,missing_allowance,fill_qualified_constant_value):
+
+        """
+        Imputes the missing values of all the columns. See impute_statistics() and apply_impute().
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame to be imputed.
+        missing_allowance : float
+            The missing ratio up to which the most frequent value (qualified) or the mean (quantified) is used.
+        fill_qualified_constant_value : str
+            The constant for the qualified columns whose missing ratio exceeds missing_allowance.
+
+        Returns:
+        --------
+        DataFrame
+            A copy of the DataFrame without missing values.
+        """
+
+        statistics = D.impute_statistics(df,missing_allowance,fill_qualified_constant_value)
+
+        return D.apply_impute(df,statistics)
+
+    @staticmethod
+    def read_header(file_path,encode):
+
+        """
+        Returns the column names of a CSV file without parsing its rows.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the CSV file.
+        encode : str
+            The encoding of the CSV file.
+
+        Returns:
+        --------
+        list
+            The column names without leading and trailing whitespace.
+        """
+
+        header = pd.read_csv(file_path,encoding = encode,nrows = 0).columns
+
+        return [c.strip() for c in header]
+
     @staticmethod    
     def get_questions_as_df(df):
 
@@ -169,6 +543,166 @@ class D:
     
 
 
+class ImputeModel:
+
+    """
+    A fitted imputation model which can be saved, loaded, and applied to new batches of responses without refitting.
+
+    Attributes:
+    -----------
+    missing_allowance : float
+        The missing ratio up to which the most frequent value (qualified) or the mean (quantified) is used.
+    fill_qualified_constant_value : str
+        The constant for the qualified columns whose missing ratio exceeds missing_allowance.
+    statistics : DataFrame
+        The per-column strategy and fill value chosen by D.impute_statistics(). None until fit() is called.
+
+    Methods:
+    --------
+    fit(df):
+        Chooses the strategy and fill value of every column.
+
+    transform(df):
+        Fills the missing values of a DataFrame with the fitted fill values.
+
+    transform_csv(file_path, encode, likert_scale, chunksize):
+        Reads new responses from a CSV file in chunks and yields them imputed.
+
+    save(file_path) / load(file_path):
+        Writes the fitted model into a YAML file and reads it back.
+    """
+
+    def __init__(self,missing_allowance = .1,fill_qualified_constant_value = 'Empty'):
+
+        self.missing_allowance = missing_allowance
+        self.fill_qualified_constant_value = fill_qualified_constant_value
+        self.statistics = None
+
+    def fit(self,df):
+
+        """
+        Chooses the strategy and fill value of every column, as D.main_impute() does.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            The DataFrame after the Likert scale replacement.
+
+        Returns:
+        --------
+        ImputeModel
+            The fitted model itself.
+        """
+
+        self.statistics = D.impute_statistics(df,self.missing_allowance,self.fill_qualified_constant_value)
+
+        return self
+
+    def transform(self,df):
+
+        """
+        Fills the missing values of a DataFrame with the fitted fill values. The cost only depends on the rows of df.
+
+        Parameters:
+        -----------
+        df : DataFrame
+            A batch of responses after the Likert scale replacement.
+
+        Returns:
+        --------
+        DataFrame
+            A copy of the DataFrame without missing values.
+        """
+
+        if self.statistics is None:
+            raise ValueError('ImputeModel is not fitted yet. Call fit() or load() first.')
+
+        return D.apply_impute(df,self.statistics)
+
+    def fit_transform(self,df):
+
+        return self.fit(df).transform(df)
+
+    def transform_csv(self,file_path,encode,likert_scale,chunksize = 1000):
+
+        """
+        Reads new responses from a CSV file in chunks, replaces the Likert scale answers and yields the imputed chunks.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the CSV file with the new responses.
+        encode : str
+            The encoding of the CSV file.
+        likert_scale : dict
+            The mapping from answers to scores, e.g. scales.yaml.
+        chunksize : int
+            The number of rows in each chunk.
+
+        Yields:
+        -------
+        DataFrame
+            An imputed chunk.
+        """
+
+        for chunk in pd.read_csv(file_path,encoding = encode,chunksize = chunksize):
+
+            chunk = chunk.rename(columns = dict(zip(chunk.columns,[c.strip() for c in chunk.columns])))
+            chunk = D.replacement(chunk,likert_scale)
+
+            yield self.transform(chunk)
+
+    def save(self,file_path):
+
+        """
+        Writes the fitted model into a YAML file.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the YAML file.
+        """
+
+        if self.statistics is None:
+            raise ValueError('ImputeModel is not fitted yet. Call fit() first.')
+
+        columns = {}
+
+        for c, row in self.statistics.iterrows():
+            columns[c] = {k: (v.item() if isinstance(v, np.generic) else v) for k, v in row.items()}
+
+        ym = co.YamlManager(file_path)
+        ym.write_yaml({
+            'missing_allowance': self.missing_allowance,
+            'fill_qualified_constant_value': self.fill_qualified_constant_value,
+            'columns': columns})
+
+    @classmethod
+    def load(cls,file_path):
+
+        """
+        Reads a fitted model from a YAML file written by save().
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the YAML file.
+
+        Returns:
+        --------
+        ImputeModel
+            The fitted model.
+        """
+
+        ym = co.YamlManager(file_path)
+        data = ym.read_yaml()
+
+        model = cls(data['missing_allowance'],data['fill_qualified_constant_value'])
+        model.statistics = pd.DataFrame.from_dict(data['columns'],orient = 'index')
+
+        return model
+
+
 class Q:
     
     """
@@ -188,6 +722,12 @@ class Q:
         A DataFrame containing the survey data for the year 2020.
     df_2021 : DataFrame
         A DataFrame containing the survey data for the year 2021.
+    model_index : mappingproxy
+        A read-only index from each data model to its question IDs.
+    type_index : mappingproxy
+        A read-only index from each question type to its question IDs.
+    original_columns : mappingproxy
+        A read-only index from each question ID to its original column names in 2020 and 2021.
 
     Methods:
     --------
@@ -208,6 +748,15 @@ class Q:
         
     question_combination(year, df_dict, suffix):
         Returns a list of combinations of question pairs from merged DataFrames for a specified year.
+
+    question_pairs(qid1, qid2, year, suffix):
+        Returns the combinations of the original questions of two question IDs without building any DataFrame.
+
+    pair_arrays(year, question1, question2, suffix):
+        Returns aligned zero-copy views of two original question columns of a year.
+
+    get_original_ids(questions, q_models, year_idx):
+        Returns the original question IDs of a year which belong to the specified data models.
     """
 
     def __init__(self,questions,questions_2020,questions_2021,df_2020,df_2021):
@@ -239,10 +788,31 @@ class Q:
         self.df_2020 = df_2020
         self.df_2021 = df_2021
 
+        # the indexes are built once and never mutated, so a Q object can be shared by parallel workers
+        model_index = {}
+        type_index = {}
+        original_columns = {}
+
+        for qid, q_info in questions.items():
+
+            for q_model in q_info['data model']:
+                model_index.setdefault(q_model,[]).append(qid)
+
+            type_index.setdefault(q_info['type'],[]).append(qid)
+
+            original_columns[qid] = tuple(
+                tuple(q_df.loc[q_info['original IDs'][idx],:].values.ravel().tolist())
+                for idx, q_df in enumerate([questions_2020,questions_2021]))
+
+        self.model_index = MappingProxyType({k: tuple(v) for k, v in model_index.items()})
+        self.type_index = MappingProxyType({k: tuple(v) for k, v in type_index.items()})
+        self.original_columns = MappingProxyType(original_columns)
+
     def get_q_info(self,search_qid):
 
         """
         Retrieves and prints information for a specified question ID.
+        It has no side effect on the object, so it is safe to call from parallel workers.
         
         Parameters:
         -----------
@@ -255,14 +825,7 @@ class Q:
             A dictionary containing the information of the specified question ID.
         """
 
-        self.q_info = self.questions[search_qid]
-        self.qid_2020 = self.q_info['original IDs'][0] # question ids in 2020
-        self.qid_2021 = self.q_info['original IDs'][1] # question ids in 2021
-        self.q_text = self.q_info['question'] # brief question
-        self.q_type = self.q_info['type']
-        self.q_model = self.q_info['data model']
-
-        return self.q_info
+        return self.questions[search_qid]
 
     def get_qid_type(self,q_type,questions,print_):
 
@@ -284,11 +847,15 @@ class Q:
             A list of question IDs matching the specified type.
         """
 
-        qid_list = []
+        if questions is self.questions:
+            qid_list = list(self.type_index.get(q_type,()))
 
-        for qid, q_info in questions.items():
-            if q_info['type'] == q_type:
-                qid_list.append(qid)
+        else:
+            qid_list = []
+
+            for qid, q_info in questions.items():
+                if q_info['type'] == q_type:
+                    qid_list.append(qid)
 
         if print_ == True:
             print('The question numbers: {}'.format(qid_list))
@@ -315,11 +882,15 @@ class Q:
             A list of question IDs associated with the specified data model.
         """
 
-        qid_list = []
+        if questions is self.questions:
+            qid_list = list(self.model_index.get(q_model,()))
 
-        for qid, q_info in questions.items():
-            if q_model in q_info['data model']:
-                qid_list.append(qid)
+        else:
+            qid_list = []
+
+            for qid, q_info in questions.items():
+                if q_model in q_info['data model']:
+                    qid_list.append(qid)
 
         if print_ == True:
             print('The question numbers of {}: {}'.format(q_model,qid_list))
@@ -344,15 +915,11 @@ class Q:
 
         df_list = []
 
-        q_info_ = self.get_q_info(qid)
-
-        for idx, q_dict in {0:{'qs':self.questions_2020,'q_df':self.df_2020},1:{'qs':self.questions_2021,'q_df':self.df_2021}}.items():
-
-            target_qid_original_qids = q_info_['original IDs'][idx]
+        for idx, q_df in enumerate([self.df_2020,self.df_2021]):
 
-            target_qid_original_qs = q_dict['qs'].loc[target_qid_original_qids,:].values.ravel().tolist()
+            target_qid_original_qs = list(self.original_columns[qid][idx])
 
-            result_df = q_dict['q_df'].loc[:,self.id + target_qid_original_qs]
+            result_df = q_df.loc[:,self.id + target_qid_original_qs]
 
             df_list.append(result_df)
 
@@ -362,6 +929,7 @@ class Q:
 
         """
         Merges DataFrames of two specified question IDs for both years and returns a dictionary containing them.
+        See pair_arrays() for the accessor which does not build any DataFrame.
         
         Parameters:
         -----------
@@ -381,8 +949,19 @@ class Q:
         df_left_list = self.one_qid_dfs(qid1)
         df_right_list = self.one_qid_dfs(qid2)
 
-        left_right_2020 = pd.merge(df_left_list[0],df_right_list[0],on = self.id, how = 'inner',suffixes = suffixes_)
-        left_right_2021 = pd.merge(df_left_list[1],df_right_list[1],on = self.id, how = 'inner',suffixes = suffixes_)
+        # both sides come from the same wave frame, so the rows are already aligned and no join is needed
+        merged_list = []
+
+        for df_left, df_right in zip(df_left_list,df_right_list):
+
+            df_right = df_right.drop(columns = self.id)
+            duplicated_qs = set(df_left.columns) & set(df_right.columns)
+            df_right = df_right.rename(columns = {q:'{}{}'.format(q,suffixes_[1]) for q in duplicated_qs})
+            df_left = df_left.rename(columns = {q:'{}{}'.format(q,suffixes_[0]) for q in duplicated_qs})
+
+            merged_list.append(pd.concat([df_left,df_right],axis = 1))
+
+        left_right_2020, left_right_2021 = merged_list
 
         df_dict = {
             '2020':{'left':df_left_list[0], 'right':df_right_list[0],'merged':left_right_2020},
@@ -423,7 +1002,103 @@ class Q:
         right_qs = ['{}{}'.format(q,suffix) if q in duplicated_qs else q for q in right_qs]
 
         return list(itertools.product(left_qs,right_qs))
+
+    def question_pairs(self,qid1,qid2,year,suffix = '_duplicated'):
+
+        """
+        Returns the combinations of the original questions of two question IDs from the column index, without building any DataFrame.
+        The questions of qid2 which also belong to qid1 get the suffix, as in question_combination().
+        
+        Parameters:
+        -----------
+        qid1 : str
+            The first question ID.
+        qid2 : str
+            The second question ID.
+        year : str
+            The year to generate combinations for ('2020' or '2021').
+        suffix : str
+            A suffix to apply to duplicate question columns of qid2.
+        
+        Returns:
+        --------
+        list
+            A list of tuples representing all possible question combinations.
+        """
+
+        idx = ['2020','2021'].index(year)
+
+        left_qs = list(dict.fromkeys(self.original_columns[qid1][idx]))
+        right_qs = list(dict.fromkeys(self.original_columns[qid2][idx]))
+
+        right_qs = ['{}{}'.format(q,suffix) if q in left_qs else q for q in right_qs]
+
+        return list(itertools.product(left_qs,right_qs))
+
+    def pair_arrays(self,year,question1,question2,suffix = '_duplicated'):
+
+        """
+        Returns aligned zero-copy views of two original question columns of a year, indexed by Response ID.
+        A question with the suffix refers to the same column as the question without it, and keeps the suffix as its name.
+        
+        Parameters:
+        -----------
+        year : str
+            The year of the survey ('2020' or '2021').
+        question1 : str
+            The first original question.
+        question2 : str
+            The second original question.
+        suffix : str
+            The suffix of duplicate question columns.
+        
+        Returns:
+        --------
+        tuple
+            The Series of question1 and question2 sharing the memory of the survey DataFrame.
+        """
+
+        df = {'2020':self.df_2020,'2021':self.df_2021}[year]
+        response_index = pd.Index(df.loc[:,self.id[0]].values,name = self.id[0])
+
+        arrs = []
+
+        for q in (question1,question2):
+
+            original_q = q[:-len(suffix)] if q.endswith(suffix) else q
+            arrs.append(pd.Series(df.loc[:,original_q].array,index = response_index,name = q,copy = False))
+
+        return tuple(arrs)
     
+    @staticmethod
+    def get_original_ids(questions,q_models,year_idx):
+
+        """
+        Returns the original question IDs of a year which belong to the specified data models.
+
+        Parameters:
+        -----------
+        questions : dict
+            The dictionary of questions to search within.
+        q_models : list
+            The data models to look up, e.g. ['TMS','WPB'].
+        year_idx : int
+            0 for 2020 and 1 for 2021.
+
+        Returns:
+        --------
+        list
+            A sorted list of the original question IDs without duplicates.
+        """
+
+        original_ids = set()
+
+        for q_info in questions.values():
+            if len(set(q_models) & set(q_info['data model'])) > 0:
+                original_ids.update(q_info['original IDs'][year_idx])
+
+        return sorted(original_ids)
+
     @staticmethod    
     def get_qdfs(rawdata_list):
 
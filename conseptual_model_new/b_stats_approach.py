@@ -9,7 +9,10 @@ import correlation_test as ct
 import correlation as cor
 import distribution_test as dit
 import utility as u
+import result_cache as rc
 import numpy as np
+import pandas as pd
+import traceback
 
 def qualified_quantified_test(distribution_variance_test_result,print_,threshold,*observed):
 
@@ -26,7 +29,347 @@ def qualified_quantified_test(distribution_variance_test_result,print_,threshold
 
     return test_result
 
-def main(id,q_comb,target_qids_dfs,years,print_,threshold,likert_scale,**kwargs):
+def test_route(arr_types):
+    """
+    Decides which statistical test is appropriate based on the types of two arrays, as main() does.
+
+    Parameters:
+    arr_types : list
+        The types of the two arrays (see utility.istype).
+
+    Returns:
+    str
+        'chi2', 'ANOVA/kruskal', 'welch_t', or None when a type is unknown.
+    """
+
+    if arr_types == ['qualified','qualified']:
+        return 'chi2'
+
+    elif arr_types in [['qualified','quantified'],['quantified','qualified']]:
+        return 'ANOVA/kruskal'
+
+    elif arr_types == ['quantified','quantified']:
+        return 'welch_t'
+
+    return None
+
+def compile_plan(q_comb,columns,catalog):
+    """
+    Assigns each question combination its statistical test and correlation measure from the column profiles, before anything is computed.
+    The columns are oriented as in main(): arr1 is the second question and arr2 the first one.
+    Pairs with an unknown type or missing values are routed to 'scalar', i.e. to main().
+
+    Parameters:
+    q_comb : list
+        A list of question combinations to analyze.
+    columns : dict
+        The columns of the questions, looked up by name.
+    catalog : utility.ColumnCatalog
+        The profiles of the columns.
+
+    Returns:
+    DataFrame
+        The plan with one row per combination: 'question1', 'question2', 'test_route', 'corr_route',
+        and 'group' and 'value' (the qualified and the quantified question) for the grouped tests and the correlation ratio.
+    """
+
+    plan = []
+
+    for q1, q2 in q_comb:
+
+        profiles = [catalog.profile(columns[q]) for q in [q2,q1]] # arr1, arr2
+        arr_types = [profile['type'] for profile in profiles]
+        arr_scales = [profile['scale'] for profile in profiles]
+
+        route = test_route(arr_types)
+        corr_route = cor.correlation_route(arr_types,arr_scales)
+
+        if route is None or any(profile['missing_ratio'] > 0 for profile in profiles):
+            route = corr_route = 'scalar'
+
+        if arr_types[0] == 'qualified' and arr_types[1] == 'quantified':
+            group, value = q2, q1
+        elif arr_types[0] == 'quantified' and arr_types[1] == 'qualified':
+            group, value = q1, q2
+        else:
+            group = value = None
+
+        plan.append([q1,q2,route,corr_route,group,value])
+
+    return pd.DataFrame(plan,columns = ['question1','question2','test_route','corr_route','group','value'])
+
+def plan_summary(plan):
+    """
+    Counts the question combinations of a plan per statistical test and correlation measure.
+
+    Parameters:
+    plan : DataFrame
+        The plan made by compile_plan().
+
+    Returns:
+    DataFrame
+        The number of combinations per ('test_route', 'corr_route').
+    """
+
+    return plan.groupby(['test_route','corr_route']).size().rename('pairs').reset_index()
+
+def run_plan(plan,columns,years,threshold,likert_scale,cache = None,precheck = None,catalog = None):
+    """
+    Executes a plan made by compile_plan(). The combinations of each route are handed to a batched kernel at once,
+    and the results are the same as those of main() in the same order. Nothing is printed.
+
+    Parameters:
+    plan : DataFrame
+        The plan made by compile_plan().
+    columns : dict
+        The columns of the questions, looked up by name.
+    years : str
+        The year to analyze.
+    threshold : float
+        The significance level for statistical tests.
+    likert_scale : list
+        A list of values representing the Likert scale.
+    cache : result_cache.PairResultCache, optional
+        An on-disk cache consulted before running the tests of a pair.
+    precheck : distribution_test.DistributionPrecheck, optional
+        A memo of the normality and homogeneity prechecks, with the same threshold.
+    catalog : utility.ColumnCatalog, optional
+        The profiles of the columns, used by the 'scalar' combinations.
+
+    Returns:
+    list
+        A list containing the results of the statistical tests and correlation measures for each question combination.
+    """
+
+    test_results = [None] * len(plan)
+    corr_results = [None] * len(plan)
+    cache_keys = [None] * len(plan)
+
+    if cache is not None:
+
+        config = rc.config_fingerprint(threshold,likert_scale)
+        fingerprints = {q:rc.column_fingerprint(columns[q]) for q in dict.fromkeys(list(plan['question1']) + list(plan['question2']))}
+
+        for i, (q1, q2) in enumerate(zip(plan['question1'],plan['question2'])):
+
+            cache_keys[i] = cache.key(q1,q2,years,config,fingerprints[q1],fingerprints[q2])
+            cached_result = cache.get(cache_keys[i])
+
+            if cached_result is not None:
+                test_results[i], corr_results[i] = cached_result[:2], cached_result[2:]
+
+    pending = plan[[result is None for result in test_results]]
+
+    # pairs which cannot be batched
+    scalar = pending[pending['test_route'] == 'scalar']
+
+    if len(scalar) > 0:
+
+        scalar_results = main(None,list(zip(scalar['question1'],scalar['question2'])),lambda years, q1, q2: (columns[q1], columns[q2]),years,False,threshold,likert_scale,precheck = precheck,catalog = catalog)
+
+        for i, result in zip(scalar.index,scalar_results):
+            test_results[i], corr_results[i] = result[2:4], result[4:]
+
+    # chi-square tests (arr1 on the rows)
+    chi2_pairs = pending[pending['test_route'] == 'chi2']
+    chi2_results = ct.chi2_batch(columns,list(zip(chi2_pairs['question2'],chi2_pairs['question1'])),threshold)
+
+    for i, p, result in zip(chi2_pairs.index,chi2_results['p-value'],chi2_results['test_result']):
+        test_results[i] = [p, result]
+
+    # one-way ANOVA or Kruskal-Wallis H-test, chosen by the distribution prechecks
+    grouped_pairs = pending[pending['test_route'] == 'ANOVA/kruskal']
+    grouped = list(zip(grouped_pairs['group'],grouped_pairs['value']))
+
+    if precheck is None:
+        precheck = dit.DistributionPrecheck(threshold)
+
+    moments = {} # the Bartlett tests of the prechecks reuse the group moments of the batch
+    grouped_results = ct.grouped_test_batch(columns,grouped,threshold,moments = moments)
+    distribution_variance_test_results = precheck.precompute(columns,grouped,moments)
+
+    ANOVA_results = zip(grouped_results['ANOVA_p-value'],grouped_results['ANOVA_result'])
+    kruskal_results = zip(grouped_results['kruskal_p-value'],grouped_results['kruskal_result'])
+
+    for i, distribution_variance_test_result, ANOVA_result, kruskal_result in zip(grouped_pairs.index,distribution_variance_test_results,ANOVA_results,kruskal_results):
+
+        if distribution_variance_test_result == [True,True]: # one-way-ANOVA
+            test_results[i] = list(ANOVA_result)
+
+        elif distribution_variance_test_result == [True,False] or distribution_variance_test_result[0] == False: # kruskal
+            test_results[i] = list(kruskal_result)
+
+        else: # something wrong
+            test_results[i] = [np.nan,np.nan]
+
+    # Welch's t-tests
+    welch_pairs = pending[pending['test_route'] == 'welch_t']
+    welch_results = ct.welch_t_test_batch(columns,list(zip(welch_pairs['question2'],welch_pairs['question1'])),threshold)
+
+    for i, p, result in zip(welch_pairs.index,welch_results['p-value'],welch_results['test_result']):
+        test_results[i] = [p, result]
+
+    # correlation measures
+    for name, batch in [('Spearman',cor.spearman_matrix),('Peason',cor.pearson_matrix)]:
+
+        pairs = pending[pending['corr_route'] == name]
+
+        if len(pairs) == 0:
+            continue
+
+        matrix, pvalue = batch(columns,list(dict.fromkeys(list(pairs['question1']) + list(pairs['question2']))))
+
+        for i, q1, q2 in zip(pairs.index,pairs['question1'],pairs['question2']):
+            corr_results[i] = [matrix.at[q2,q1], pvalue.at[q2,q1], name]
+
+    # Cramer's V from the counts of the chi-square tests
+    pairs = pending[pending['corr_route'] == 'Cramers V']
+
+    if len(pairs) > 0:
+
+        cramers_v = cor.cramers_v_matrix(columns,list(dict.fromkeys(list(pairs['question1']) + list(pairs['question2']))),chi2_results = chi2_results[(chi2_pairs['corr_route'] == 'Cramers V').values])
+
+        for i, q1, q2 in zip(pairs.index,pairs['question1'],pairs['question2']):
+            corr_results[i] = [cramers_v.at[q2,q1], np.NaN, 'Cramers V']
+
+    pairs = pending[pending['corr_route'] == 'correlation ratio']
+    ratios = cor.corr_ratio_batch(columns,list(zip(pairs['group'],pairs['value'])))
+
+    for i, corr in zip(pairs.index,ratios.values):
+        corr_results[i] = [corr, np.NaN, 'correlation ratio']
+
+    for i in pending[pending['corr_route'] == 'Bad request'].index:
+        corr_results[i] = [np.NaN, np.NaN, 'Bad request']
+
+    result_list = []
+    computed = set(pending.index)
+
+    for i, (q1, q2) in enumerate(zip(plan['question1'],plan['question2'])):
+
+        if cache is not None and i in computed:
+            cache.put(cache_keys[i],test_results[i] + corr_results[i])
+
+        result_list.append([q1,q2] + test_results[i] + corr_results[i])
+
+    if cache is not None:
+        cache.flush() # one transaction per plan or chunk
+
+    return result_list
+
+# the data shipped once to each worker process by init_worker()
+worker_data = {}
+
+def init_worker(columns,years,threshold,likert_scale,catalog,cache_file_path = None):
+    """
+    Initializes a worker process of a process pool with the data of a sweep, so that the tasks carry only their chunks of the plan.
+
+    Parameters:
+    columns : dict or shared_data.SharedSurvey
+        The columns of the questions, looked up by name. A SharedSurvey is attached without copying the data.
+    years : str
+        The year to analyze.
+    threshold : float
+        The significance level for statistical tests.
+    likert_scale : list
+        A list of values representing the Likert scale.
+    catalog : utility.ColumnCatalog
+        The profiles of the columns.
+    cache_file_path : str, optional
+        The SQLite file of a result_cache.PairResultCache to be opened by the worker.
+    """
+
+    worker_data.clear()
+    worker_data.update({
+        'columns':columns,
+        'years':years,
+        'threshold':threshold,
+        'likert_scale':likert_scale,
+        'catalog':catalog,
+        'precheck':dit.DistributionPrecheck(threshold),
+        'cache':rc.PairResultCache(cache_file_path) if cache_file_path is not None else None})
+
+def run_chunk(plan_chunk):
+    """
+    Runs a chunk of a plan in a worker process initialized by init_worker().
+    If the chunk fails, its pairs are run one by one so that only the failing pairs are lost.
+
+    Parameters:
+    plan_chunk : DataFrame
+        A chunk of the plan made by compile_plan().
+
+    Returns:
+    tuple
+        The results of the pairs which succeeded, as run_plan() returns them,
+        and a list of [question1, question2, traceback] for the pairs which failed.
+    """
+
+    kwargs = {key:worker_data[key] for key in ['years','threshold','likert_scale','cache','precheck','catalog']}
+
+    try:
+        return run_plan(plan_chunk.reset_index(drop = True),worker_data['columns'],**kwargs), []
+
+    except Exception:
+
+        result_list = []
+        errors = []
+
+        for i in range(len(plan_chunk)):
+
+            try:
+                result_list += run_plan(plan_chunk.iloc[[i]].reset_index(drop = True),worker_data['columns'],**kwargs)
+
+            except Exception:
+                errors.append([plan_chunk['question1'].iloc[i],plan_chunk['question2'].iloc[i],traceback.format_exc()])
+
+        return result_list, errors
+
+def build_lookup(columns,q_comb,likert_scale,precheck = None,catalog = None):
+    """
+    Precomputes the correlation measures of many question combinations at once for correlation.compute_correlation.
+    Each column is ranked once for the Spearman matrix, and all the (nominal, interval) pairs share one batched correlation ratio call.
+    The distribution prechecks of all the (qualified, quantified) pairs are run at once when a precheck memo is given.
+
+    Parameters:
+    columns : dict
+        The columns of the questions, looked up by name.
+    q_comb : list
+        A list of question combinations to analyze.
+    likert_scale : list
+        A list of values representing the Likert scale.
+    precheck : distribution_test.DistributionPrecheck, optional
+        A memo of the distribution prechecks to fill.
+    catalog : utility.ColumnCatalog, optional
+        The profiles of the columns. A new catalog is made if not given.
+
+    Returns:
+    dict
+        The Spearman matrices and the correlation ratios keyed by the name of the measure.
+    """
+
+    questions = list(dict.fromkeys(q for comb_idx in q_comb for q in comb_idx))
+    if catalog is None:
+        catalog = u.ColumnCatalog(likert_scale)
+
+    profiles = {q:(catalog.profile(columns[q])['type'],catalog.profile(columns[q])['scale']) for q in questions}
+
+    ratio_pairs = []
+    grouped_pairs = []
+
+    for comb_idx in q_comb:
+        for group, value in [tuple(comb_idx),tuple(comb_idx)[::-1]]:
+
+            if profiles[group] == ('qualified','nominal scale') and profiles[value] == ('quantified','ratio scale/ interval scale'):
+                ratio_pairs.append((group,value))
+
+            if profiles[group][0] == 'qualified' and profiles[value][0] == 'quantified':
+                grouped_pairs.append((group,value))
+
+    if precheck is not None:
+        precheck.precompute(columns,list(dict.fromkeys(grouped_pairs)))
+
+    return {'Spearman':cor.spearman_matrix(columns,questions),'correlation ratio':cor.corr_ratio_batch(columns,list(dict.fromkeys(ratio_pairs)))}
+
+def main(id,q_comb,target_qids_dfs,years,print_,threshold,likert_scale,cache = None,lookup = None,precheck = None,catalog = None,**kwargs):
     """
     Conducts statistical tests and correlation measures on combinations of questions for given years.
     
@@ -35,14 +378,23 @@ def main(id,q_comb,target_qids_dfs,years,print_,threshold,likert_scale,**kwargs)
         A list to have a ID columns name.
     q_comb : list
         A list of question combinations to analyze.
-    target_qids_dfs : dict
-        A dictionary containing data frames for different years.
+    target_qids_dfs : dict or callable
+        A dictionary containing data frames for different years,
+        or a pair accessor returning the two arrays of a question combination for a year (see a_data_process.Q.pair_arrays).
     years : str
         The year to analyze.
     threshold : float
         The significance level for statistical tests.
     likert_scale : list
         A list of values representing the Likert scale.
+    cache : result_cache.PairResultCache, optional
+        An on-disk cache consulted before running the tests of a pair.
+    lookup : dict, optional
+        Precomputed correlation matrices keyed by the name of the measure (see correlation.compute_correlation).
+    precheck : distribution_test.DistributionPrecheck, optional
+        A memo of the normality and homogeneity prechecks of (qualified, quantified) pairs, with the same threshold.
+    catalog : utility.ColumnCatalog, optional
+        The profiles of the columns, read instead of calling utility.istype and utility.isscale for each pair.
 
     Returns:
     list
@@ -51,15 +403,46 @@ def main(id,q_comb,target_qids_dfs,years,print_,threshold,likert_scale,**kwargs)
 
     result_list = []
 
+    if cache is not None:
+        config = rc.config_fingerprint(threshold,likert_scale)
+
+    if cache is not None or precheck is not None:
+        fingerprints = {} # each column is hashed once
+
     for comb_idx in q_comb:
 
-        target_qid_two_arrs_df = target_qids_dfs[years]['merged'].loc[:,id + list(comb_idx)]
+        if callable(target_qids_dfs): # a pair accessor such as a_data_process.Q.pair_arrays
+
+            arr2, arr1 = target_qids_dfs(years,*comb_idx)
+
+        else:
+
+            target_qid_two_arrs_df = target_qids_dfs[years]['merged'].loc[:,id + list(comb_idx)]
 
-        arr1 = target_qid_two_arrs_df.iloc[:,2]
-        arr2 = target_qid_two_arrs_df.iloc[:,1]
+            arr1 = target_qid_two_arrs_df.iloc[:,2]
+            arr2 = target_qid_two_arrs_df.iloc[:,1]
 
-        arr_types = [u.istype(arr) for arr in [arr1,arr2]]
-        arr_scales = [u.isscale(arr,likert_scale) for arr in [arr1,arr2]]
+        if cache is not None or precheck is not None:
+
+            for arr in [arr1,arr2]:
+                if arr.name not in fingerprints:
+                    fingerprints[arr.name] = rc.column_fingerprint(arr)
+
+        if cache is not None:
+
+            cache_key = cache.key(arr2.name,arr1.name,years,config,fingerprints[arr2.name],fingerprints[arr1.name])
+            cached_result = cache.get(cache_key)
+
+            if cached_result is not None:
+                result_list.append(list(comb_idx) + cached_result)
+                continue
+
+        if catalog is not None:
+            arr_types = [catalog.profile(arr)['type'] for arr in [arr1,arr2]]
+            arr_scales = [catalog.profile(arr)['scale'] for arr in [arr1,arr2]]
+        else:
+            arr_types = [u.istype(arr) for arr in [arr1,arr2]]
+            arr_scales = [u.isscale(arr,likert_scale) for arr in [arr1,arr2]]
 
         if print_ == True:
             print('::::::::::::::::::::::::::::::::')
@@ -71,26 +454,41 @@ def main(id,q_comb,target_qids_dfs,years,print_,threshold,likert_scale,**kwargs)
 
         if arr_types == ['qualified','qualified']: # ('chi2','crosstab')
 
-            test_result = ct.crosstab_chi2(arr1,arr2, print_ , threshold, values = target_qid_two_arrs_df.loc[:,id], aggfunc = 'nunique') # [p,chi2_result]
+            # Response ID is unique in each wave, so the number of unique IDs per cell equals the plain count
+            test_result = ct.crosstab_chi2(arr1,arr2, print_ , threshold) # [p,chi2_result]
 
         elif arr_types == ['qualified','quantified']: # ('avg diff test','tab on arr1')
             
             arr_list = u.array_split(arr1,arr2)
-            distribution_variance_test_result = dit.distribution_variance_test(print_,threshold,*arr_list)
+
+            if precheck is not None:
+                distribution_variance_test_result = precheck.test(arr1,arr2,arr_list,print_,fingerprints)
+            else:
+                distribution_variance_test_result = dit.distribution_variance_test(print_,threshold,*arr_list)
             test_result = qualified_quantified_test(distribution_variance_test_result,print_,threshold,*arr_list)
 
         elif arr_types == ['quantified','qualified']: # ('avg diff test','tab on arr2')
 
             arr_list = u.array_split(arr2,arr1)
-            distribution_variance_test_result = dit.distribution_variance_test(print_,threshold,*arr_list)
+
+            if precheck is not None:
+                distribution_variance_test_result = precheck.test(arr2,arr1,arr_list,print_,fingerprints)
+            else:
+                distribution_variance_test_result = dit.distribution_variance_test(print_,threshold,*arr_list)
             test_result = qualified_quantified_test(distribution_variance_test_result,print_,threshold,*arr_list)
         
         elif arr_types == ['quantified','quantified']: # ('t test','as is')
 
             test_result = ct.t_test(arr1,arr2,'welch_t',print_)
 
-        corr_result = cor.compute_correlation(arr1,arr2,arr_types,arr_scales,print_)
+        corr_result = cor.compute_correlation(arr1,arr2,arr_types,arr_scales,print_,lookup)
+
+        if cache is not None:
+            cache.put(cache_key,test_result + list(corr_result))
 
         result_list.append(list(comb_idx) + test_result + list(corr_result))
 
+    if cache is not None:
+        cache.flush()
+
     return result_list
\ No newline at end of file
@@ -8,8 +8,10 @@ Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
 import numpy as np
 import pandas as pd
 import scipy as sp
+import correlation_test as ct
+import utility as u
 
-def pearson(arr1,arr2, print_):
+def pearson(arr1,arr2, print_,lookup = None):
     """
     Calculates the Pearson correlation coefficient between two arrays.
 
@@ -18,12 +20,19 @@ def pearson(arr1,arr2, print_):
         The first set of observations.
     arr2 : array_like
         The second set of observations.
+    lookup : dict, optional
+        Precomputed correlation matrices keyed by the name of the test. The pair is looked up in lookup['Peason'] (see pearson_matrix()) when both arrays are in it.
 
     Returns:
     tuple
         The Pearson correlation coefficient, the two-tailed p-value, and the name of the test ('Pearson').
     """
-    corr , pvalue = sp.stats.pearsonr(arr1,arr2)
+    if lookup is not None and 'Peason' in lookup and arr1.name in lookup['Peason'][0].index and arr2.name in lookup['Peason'][0].index:
+        corr = lookup['Peason'][0].at[arr1.name,arr2.name]
+        pvalue = lookup['Peason'][1].at[arr1.name,arr2.name]
+
+    else:
+        corr , pvalue = sp.stats.pearsonr(arr1,arr2)
 
     if print_ == True:
         print('-----------------')
@@ -34,7 +43,7 @@ def pearson(arr1,arr2, print_):
 
     return corr, pvalue, 'Peason'
 
-def spearman(arr1,arr2,print_):
+def spearman(arr1,arr2,print_,lookup = None):
     """
     Calculates the Spearman rank-order correlation coefficient between two arrays.
 
@@ -43,12 +52,19 @@ def spearman(arr1,arr2,print_):
         The first set of observations.
     arr2 : array_like
         The second set of observations.
+    lookup : dict, optional
+        Precomputed correlation matrices keyed by the name of the test. The pair is looked up in lookup['Spearman'] (see spearman_matrix()) when both arrays are in it.
 
     Returns:
     tuple
         The Spearman correlation coefficient, the two-tailed p-value, and the name of the test ('Spearman').
     """
-    corr , pvalue = sp.stats.spearmanr(arr1,arr2)
+    if lookup is not None and 'Spearman' in lookup and arr1.name in lookup['Spearman'][0].index and arr2.name in lookup['Spearman'][0].index:
+        corr = lookup['Spearman'][0].at[arr1.name,arr2.name]
+        pvalue = lookup['Spearman'][1].at[arr1.name,arr2.name]
+
+    else:
+        corr , pvalue = sp.stats.spearmanr(arr1,arr2)
 
     if print_ == True:
         print('-----------------')
@@ -59,6 +75,113 @@ def spearman(arr1,arr2,print_):
 
     return corr, pvalue , 'Spearman'
 
+def spearman_matrix(columns,names = None):
+    """
+    Calculates the Spearman rank-order correlation matrix of many columns at once.
+    Each column is ranked once, all the coefficients are computed as one matrix product of the centered ranks,
+    and the two-tailed p-values are computed vectorized from the t-distribution as scipy.stats.spearmanr() does.
+
+    Parameters:
+    columns : DataFrame or dict
+        The columns, looked up by name. A categorical column is ranked on its codes, i.e. in the order of its categories.
+    names : list, optional
+        The names of the columns in the matrix (default is all the columns).
+
+    Returns:
+    tuple
+        The DataFrame of the Spearman correlation coefficients and the DataFrame of the two-tailed p-values, both indexed by the names.
+    """
+    if names is None:
+        names = list(columns.keys())
+
+    ranks = np.column_stack([rank_values(columns[name]) for name in names]).reshape(-1, len(names))
+
+    return correlation_matrix(ranks,names)
+
+def pearson_matrix(columns,names = None):
+    """
+    Calculates the Pearson correlation matrix of many numeric columns at once, with the two-tailed p-values computed vectorized.
+
+    Parameters:
+    columns : DataFrame or dict
+        The numeric columns, looked up by name.
+    names : list, optional
+        The names of the columns in the matrix (default is all the columns).
+
+    Returns:
+    tuple
+        The DataFrame of the Pearson correlation coefficients and the DataFrame of the two-tailed p-values, both indexed by the names.
+    """
+    if names is None:
+        names = list(columns.keys())
+
+    values = np.column_stack([np.asarray(columns[name], dtype = float) for name in names]).reshape(-1, len(names))
+
+    return correlation_matrix(values,names)
+
+def correlation_matrix(values,names,chunk_size = 256):
+    """
+    Calculates the correlation matrix of the columns of a 2-D array from the products of the centered columns,
+    with the two-tailed p-values of the t-distribution with n - 2 degrees of freedom.
+    Each column is centered on its own and the products of each pair are summed on their own (a chunk of pairs at a time),
+    so a coefficient does not depend on which other columns are in the matrix, unlike a BLAS matrix product.
+
+    Parameters:
+    values : numpy.ndarray
+        The observations, one column per variable.
+    names : list
+        The names of the columns.
+    chunk_size : int, optional
+        The number of pairs multiplied together (default is 256).
+
+    Returns:
+    tuple
+        The DataFrame of the correlation coefficients and the DataFrame of the two-tailed p-values, both indexed by the names.
+    """
+    n = values.shape[0]
+
+    variables = np.ascontiguousarray(values.T)
+    centered = variables - variables.mean(axis = 1)[:,None]
+
+    cov = np.empty((len(names), len(names)))
+    rows, cols = np.triu_indices(len(names))
+
+    for start in range(0, len(rows), chunk_size):
+        i, j = rows[start:start + chunk_size], cols[start:start + chunk_size]
+        cov[i, j] = cov[j, i] = (centered[i] * centered[j]).sum(axis = 1)
+
+    std = np.sqrt(np.diag(cov))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        corr = np.clip(cov / np.outer(std,std), -1, 1)
+        t = corr * np.sqrt((n - 2) / ((corr + 1) * (1 - corr)))
+
+    pvalue = 2 * sp.stats.t.sf(np.abs(t), n - 2)
+
+    return pd.DataFrame(corr,index = names,columns = names), pd.DataFrame(pvalue,index = names,columns = names)
+
+def rank_values(arr):
+    """
+    Ranks the values of an array, assigning the average rank to ties. Missing values make all the ranks NaN.
+
+    Parameters:
+    arr : array_like
+        The array to rank.
+
+    Returns:
+    numpy.ndarray
+        The ranks.
+    """
+    if isinstance(arr.dtype, pd.CategoricalDtype):
+        values = arr.cat.codes.values.astype(float)
+        values[values < 0] = np.nan
+
+    else:
+        values = np.asarray(arr)
+
+    return sp.stats.rankdata(values)
+
 def cramers_v(arr1, arr2, print_):
     '''
     Calc Cramer's V.
@@ -81,8 +204,33 @@ def cramers_v(arr1, arr2, print_):
     '''
 
     # cross tabluation
-    table = np.array(pd.crosstab(arr1, arr2))
+    table = ct.contingency_table(arr1, arr2).values
+
+    corr = cramers_v_from_table(table)
+
+    if print_ == True:
+        print('-----------------')
+        print('Cramers V :{0}'.format(round(corr,3)))
+        print('arr1:{}'.format(arr1.name))
+        print('arr2:{}'.format(arr2.name))
+        print('-----------------')
     
+    return corr, np.NaN, 'Cramers V'
+
+def cramers_v_from_table(table):
+    '''
+    Calc Cramer's V from a contingency table of observed levels.
+
+    Parameters
+    ----------
+    table : numpy.ndarray
+        The contingency table.
+
+    returns corr
+    '''
+
+    table = np.asarray(table)
+
     # measured variable
     n = table.sum()
     
@@ -99,22 +247,65 @@ def cramers_v(arr1, arr2, print_):
     chisq = np.sum((table - expect) ** 2 /expect)
 
     # corr(cramer'V)
-    corr = np.sqrt(chisq / (n * (min(table.shape) -1)))
+    return np.sqrt(chisq / (n * (min(table.shape) -1)))
 
-    if print_ == True:
-        print('-----------------')
-        print('Cramers V :{0}'.format(round(corr,3)))
-        print('arr1:{}'.format(arr1.name))
-        print('arr2:{}'.format(arr2.name))
-        print('-----------------')
-    
-    return corr, np.NaN, 'Cramers V'
+def cramers_v_matrix(columns, names = None, bias_correction = False, chi2_results = None):
+    '''
+    Calc the Cramer's V matrix of many nominal columns at once.
+    The contingency counts are taken from the chi-square engine (correlation_test.chi2_batch()), so no table is built twice.
 
-def corr_ratio(arr1,arr2,print_):
+    Parameters
+    ----------
+    columns : {pandas.DataFrame, dict}
+        The nominal columns, looked up by name.
+    names : list, optional
+        The names of the columns in the matrix (default is all the columns).
+    bias_correction : bool, optional
+        Whether to apply the bias correction of Bergsma (2013) (default is False).
+    chi2_results : pandas.DataFrame, optional
+        The results of correlation_test.chi2_batch() for the pairs, if they were already computed.
+
+    returns a symmetric DataFrame of Cramer's V indexed by the names
+    '''
+
+    if names is None:
+        names = list(columns.keys())
+
+    if chi2_results is None:
+        pairs = [(names[i], names[j]) for i in range(len(names)) for j in range(i, len(names))]
+        chi2_results = ct.chi2_batch(columns, pairs)
+
+    n = chi2_results['n'].values
+    r = chi2_results['n_rows'].values
+    k = chi2_results['n_cols'].values
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        phi2 = chi2_results['chi2'].values / n
+
+        if bias_correction == True:
+            phi2 = np.maximum(0, phi2 - (k - 1) * (r - 1) / (n - 1))
+            r = r - (r - 1) ** 2 / (n - 1)
+            k = k - (k - 1) ** 2 / (n - 1)
+
+        corr = np.sqrt(phi2 / (np.minimum(r, k) - 1))
+
+    matrix = np.full((len(names), len(names)), np.nan)
+    position = {name:i for i, name in enumerate(names)}
+    rows = chi2_results['question1'].map(position).values
+    cols = chi2_results['question2'].map(position).values
+
+    matrix[rows, cols] = corr
+    matrix[cols, rows] = corr
+
+    return pd.DataFrame(matrix, index = names, columns = names)
+
+def corr_ratio(arr1,arr2,print_,lookup = None):
     '''
     returns corr, p-value(nan), 'correlation ratio'
     arr1 must be categorical variables
     arr2 must be numeric variables
+    the pair is looked up in lookup['correlation ratio'] (see corr_ratio_batch()) when it is in it
 
     correlation ratio is often denoted with mu_square(m2)
 
@@ -123,17 +314,21 @@ def corr_ratio(arr1,arr2,print_):
     if .1 <= m2 < .25 then weak correlation
     else not correlated
     '''
-    # compute total variance
-    all_var = ((arr2 - arr2.mean()) ** 2).sum()
+    if lookup is not None and 'correlation ratio' in lookup and (arr1.name,arr2.name) in lookup['correlation ratio'].index:
+        corr = lookup['correlation ratio'].at[(arr1.name,arr2.name)]
 
-    # compute intraclass variance
-    intra_class_var = sum([((arr2[arr1 == i] - arr2[ arr1== i].mean()) ** 2).sum() for i in np.unique(arr1)])
+    else:
+        # compute total variance
+        all_var = ((arr2 - arr2.mean()) ** 2).sum()
 
-    # compute interclass variance
-    inter_class_var = all_var - intra_class_var
+        # compute intraclass variance
+        intra_class_var = sum([((arr2[arr1 == i] - arr2[ arr1== i].mean()) ** 2).sum() for i in np.unique(arr1)])
 
-    # compute correlation ratio
-    corr = inter_class_var / all_var
+        # compute interclass variance
+        inter_class_var = all_var - intra_class_var
+
+        # compute correlation ratio
+        corr = inter_class_var / all_var
 
     if print_ == True:
         print('-----------------')
@@ -145,95 +340,156 @@ def corr_ratio(arr1,arr2,print_):
     return corr, np.NaN, 'correlation ratio'
 
 
-def compute_correlation(arr1,arr2,arr_types,arr_scales,print_):
+def corr_ratio_batch(columns,pairs,chunk_size = 256):
+    '''
+    Calc the correlation ratio of many (categorical, numeric) column pairs at once.
+    The group sums of a chunk of pairs with the same number of categories (see utility.shape_chunks) are aggregated from the integer category codes with a single np.bincount,
+    and the total and intraclass sums of squares give the correlation ratio as corr_ratio() does.
+
+    Parameters
+    ----------
+    columns : {pandas.DataFrame, dict}
+        The columns, looked up by name.
+    pairs : list
+        A list of (categorical column, numeric column) name pairs.
+    chunk_size : int, optional
+        The number of pairs aggregated together (default is 256).
+
+    returns a Series of the correlation ratios indexed by the pairs
+    '''
+
+    coded = {}
+    values = {}
+
+    for c1, c2 in pairs:
+        if c1 not in coded:
+            coded[c1] = u.category_codes(columns[c1])
+        if c2 not in values:
+            values[c2] = np.asarray(columns[c2], dtype = float)
+
+    corr = np.full(len(pairs), np.nan)
+
+    for n_levels, positions in u.shape_chunks([coded[c1][1] for c1, _ in pairs], chunk_size):
+
+        chunk = [pairs[i] for i in positions]
+
+        codes = np.stack([coded[c1][0] for c1, _ in chunk]).astype(np.int64)
+        y = np.stack([values[c2] for _, c2 in chunk])
+        pair_idx = np.broadcast_to(np.arange(len(chunk))[:,None], codes.shape)
+
+        # the total variance is taken over all the numeric values, the intraclass variance over the grouped ones
+        y_valid = ~np.isnan(y)
+        grouped = y_valid & (codes >= 0)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            mean = np.where(y_valid, y, 0).sum(axis = 1) / y_valid.sum(axis = 1)
+            centered = np.where(y_valid, y - mean[:,None], 0)
+            all_var = (centered ** 2).sum(axis = 1)
+
+            cells = pair_idx * n_levels + codes
+            group_sum = np.bincount(cells[grouped], weights = centered[grouped], minlength = len(chunk) * n_levels).reshape(len(chunk), n_levels)
+            group_count = np.bincount(cells[grouped], minlength = len(chunk) * n_levels).reshape(len(chunk), n_levels)
+
+            between = np.where(group_count > 0, group_sum ** 2 / group_count, 0).sum(axis = 1)
+            intra_class_var = np.where(grouped, centered ** 2, 0).sum(axis = 1) - between
+
+            corr[positions] = (all_var - intra_class_var) / all_var
+
+    index = pd.MultiIndex.from_tuples(pairs, names = ['question1','question2']) if len(pairs) > 0 else None
+
+    return pd.Series(corr, index = index, dtype = float, name = 'correlation ratio')
+
+def correlation_route(arr_types,arr_scales):
     """
     Decides which correlation measure is appropriate based on the types and scales of two arrays.
-    
+
     Parameters:
-    arr1 : array_like
-        The first array.
-    arr2 : array_like
-        The second array.
-    likert_scale : list
-        A list of values representing the Likert scale.
+    arr_types : list
+        The types of the two arrays (see utility.istype).
+    arr_scales : list
+        The scales of the two arrays (see utility.isscale).
 
     Returns:
     str
-        The name of the appropriate correlation measure.
+        The name of the measure: 'Spearman', 'Cramers V', 'correlation ratio', 'Peason' or 'Bad request'.
+        The correlation ratio takes the qualified array as the categorical one.
     """
-    
+
     if arr_types ==['qualified','qualified']:
 
-        if arr_scales == ['nominal scale','rank scale']:
+        if arr_scales in [['nominal scale','rank scale'],['rank scale','nominal scale'],['rank scale','rank scale']]:
+            return 'Spearman'
 
-            return spearman(arr1,arr2,print_)
+        elif arr_scales == ['nominal scale','nominal scale']:
+            return 'Cramers V'
 
-        elif arr_scales == ['rank scale','nominal scale']:
+    elif arr_types == ['qualified','quantified']:
 
-            return spearman(arr1,arr2,print_)
+        if arr_scales == ['nominal scale','ratio scale/ interval scale']:
+            return 'correlation ratio'
 
-        elif arr_scales == ['rank scale','rank scale']:
-            
-            return spearman(arr1,arr2,print_)
+        elif arr_scales in [['nominal scale','rank scale'],['rank scale','rank scale'],['rank scale','ratio scale/ interval scale']]:
+            return 'Spearman'
 
-        elif arr_scales == ['nominal scale','nominal scale']:
+    elif arr_types == ['quantified','qualified']:
 
-            return cramers_v(arr1, arr2, print_)
-        
-        else:
-            return np.NaN,np.NaN, 'Bad request'
+        if arr_scales == ['ratio scale/ interval scale','nominal scale']:
+            return 'correlation ratio'
 
-    elif arr_types == ['qualified','quantified']:
-        
-        if arr_scales[0] == 'nominal scale' and arr_scales[1] == 'ratio scale/ interval scale':
+        elif arr_scales in [['rank scale','nominal scale'],['rank scale','rank scale'],['ratio scale/ interval scale','rank scale']]:
+            return 'Spearman'
 
-            return corr_ratio(arr1,arr2,print_)
-        
-        elif arr_scales[0] == 'nominal scale' and arr_scales[1] == 'rank scale':
+    elif arr_types == ['quantified','quantified']:
 
-            return spearman(arr1,arr2,print_)
-        
-        elif arr_scales[0] == 'rank scale' and arr_scales[1] == 'rank scale':
+        if arr_scales[0] == 'rank scale' or arr_scales[1] == 'rank scale':
+            return 'Spearman'
+
+        else:
+            return 'Peason'
 
-            return spearman(arr1,arr2,print_)
+    return 'Bad request'
 
-        elif arr_scales[0] == 'rank scale' and arr_scales[1] == 'ratio scale/ interval scale':
+def compute_correlation(arr1,arr2,arr_types,arr_scales,print_,lookup = None):
+    """
+    Computes the correlation measure which is appropriate based on the types and scales of two arrays (see correlation_route()).
+    
+    Parameters:
+    arr1 : array_like
+        The first array.
+    arr2 : array_like
+        The second array.
+    likert_scale : list
+        A list of values representing the Likert scale.
+    lookup : dict, optional
+        Precomputed correlation results keyed by the name of the test, e.g. {'Spearman':spearman_matrix(df), 'correlation ratio':corr_ratio_batch(df,pairs)}.
 
-            return spearman(arr1,arr2,print_)
+    Returns:
+    tuple
+        The correlation, the p-value and the name of the measure.
+    """
 
-        else:
-            return np.NaN,np.NaN, 'Bad request'
+    route = correlation_route(arr_types,arr_scales)
 
-    elif arr_types == ['quantified','qualified']:
-        
-        if arr_scales[0] == 'ratio scale/ interval scale' and arr_scales[1] == 'nominal scale':
+    if route == 'Spearman':
 
-            return corr_ratio(arr2,arr1,print_)
-        
-        elif arr_scales[0] == 'rank scale' and arr_scales[1] == 'nominal scale':
+        return spearman(arr1,arr2,print_,lookup)
 
-            return spearman(arr1,arr2,print_)
-        
-        elif arr_scales[0] == 'rank scale' and arr_scales[1] == 'rank scale':
+    elif route == 'Cramers V':
 
-            return spearman(arr1,arr2,print_)
+        return cramers_v(arr1, arr2, print_)
 
-        elif arr_scales[0] == 'ratio scale/ interval scale' and arr_scales[1] == 'rank scale':
+    elif route == 'correlation ratio':
 
-            return spearman(arr1,arr2,print_)
+        if arr_types[0] == 'qualified':
+            return corr_ratio(arr1,arr2,print_,lookup)
 
         else:
-            return np.NaN,np.NaN, 'Bad request'
+            return corr_ratio(arr2,arr1,print_,lookup)
 
-    elif arr_types == ['quantified','quantified']:
+    elif route == 'Peason':
 
-        if arr_scales[0] == 'rank scale' or arr_scales[1] == 'rank scale':
+        return pearson(arr1,arr2, print_,lookup)
 
-            return spearman(arr1,arr2,print_)
-
-        else:
-    
-            return pearson(arr1,arr2, print_)
-    
     else:
         return np.NaN,np.NaN, 'Bad request'
@@ -9,6 +9,7 @@ from scipy.stats import chi2_contingency
 import numpy as np
 import pandas as pd
 import scipy as sp
+import utility as u
 
 def chi2(observed,print_,threshold = .05):
     
@@ -51,6 +52,41 @@ def chi2(observed,print_,threshold = .05):
 
     return [p, chi2_result]
 
+def contingency_table(arr1,arr2):
+
+    """
+    Counts the co-occurrences of two qualified arrays from their integer codes.
+    Only the observed levels are kept, in the same way as pd.crosstab().
+
+    Parameters:
+    arr1 : pandas.Series
+        The variable on the rows.
+    arr2 : pandas.Series
+        The variable on the columns.
+
+    Returns:
+    DataFrame
+        The contingency table whose index and columns are named after arr1 and arr2.
+    """
+
+    codes1, n_levels1 = u.category_codes(arr1)
+    codes2, n_levels2 = u.category_codes(arr2)
+
+    # missing values are not counted
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    counts = np.bincount(codes1[valid].astype(np.int64) * n_levels2 + codes2[valid], minlength = n_levels1 * n_levels2)
+    counts = counts.reshape(n_levels1, n_levels2)
+
+    rows = counts.sum(axis = 1) > 0
+    cols = counts.sum(axis = 0) > 0
+
+    levels1 = arr1.cat.categories if isinstance(arr1.dtype, pd.CategoricalDtype) else pd.unique(arr1[codes1 >= 0])
+    levels2 = arr2.cat.categories if isinstance(arr2.dtype, pd.CategoricalDtype) else pd.unique(arr2[codes2 >= 0])
+
+    return pd.DataFrame(counts[rows][:,cols],
+                        index = pd.Index(np.asarray(levels1)[rows], name = arr1.name),
+                        columns = pd.Index(np.asarray(levels2)[cols], name = arr2.name))
+
 def crosstab_chi2(arr1,arr2,print_,threshold,**kwargs):
 
     """
@@ -64,19 +100,108 @@ def crosstab_chi2(arr1,arr2,print_,threshold,**kwargs):
     threshold : float
         The significance level for the Chi-Squared test.
     **kwargs : dict, optional
-        Additional keyword arguments to be passed to pd.crosstab().
+        Additional keyword arguments to be passed to pd.crosstab(). Without them, the table is counted from the integer codes.
 
     Returns:
     list
         A list containing the p-value and a boolean indicating whether the variables represented by arr1 and arr2 can be considered correlated.
     """
     
-    observed = pd.crosstab(arr1,arr2,**kwargs)
+    if len(kwargs) == 0:
+        observed = contingency_table(arr1,arr2)
+    else:
+        observed = pd.crosstab(arr1,arr2,**kwargs)
+
     observed_filled = observed.fillna(0)
 
     return chi2(observed_filled,print_,threshold)
 
 
+def chi2_batch(columns,pairs,threshold = .05,chunk_size = 256):
+
+    """
+    Performs the Chi-Squared test of independence on many pairs of qualified columns at once.
+    Each column is coded once, the pairs are chunked by the numbers of categories of their columns (see utility.shape_chunks),
+    the contingency tables of a chunk are counted with a single np.bincount into a 3-D array,
+    and the statistics, degrees of freedom and p-values are computed vectorized. The result of a pair does not depend on the other pairs.
+    The results are identical to crosstab_chi2() (scipy.stats.chi2_contingency with Yates' correction when dof is 1).
+
+    Parameters:
+    columns : DataFrame or dict
+        The qualified columns, looked up by name.
+    pairs : list
+        A list of (column1, column2) name pairs. column1 is on the rows of the tables.
+    threshold : float, optional
+        The significance level for the Chi-Squared test (default is .05).
+    chunk_size : int, optional
+        The number of pairs counted together (default is 256).
+
+    Returns:
+    DataFrame
+        A DataFrame with one row per pair in the order of pairs: 'statistic' (the test statistic), 'chi2' (without Yates' correction), 'dof', 'p-value',
+        'test_result', 'n', 'n_rows' and 'n_cols' (the numbers of observed levels).
+    """
+
+    coded = {}
+
+    for name in dict.fromkeys(c for pair in pairs for c in pair):
+        coded[name] = u.category_codes(columns[name])
+
+    results = []
+
+    for (n_rows, n_cols), positions in u.shape_chunks([(coded[c1][1], coded[c2][1]) for c1, c2 in pairs], chunk_size):
+
+        chunk = [pairs[i] for i in positions]
+
+        codes1 = np.stack([coded[c1][0] for c1, _ in chunk]).astype(np.int64)
+        codes2 = np.stack([coded[c2][0] for _, c2 in chunk]).astype(np.int64)
+        pair_idx = np.broadcast_to(np.arange(len(chunk))[:,None], codes1.shape)
+
+        # missing values are not counted
+        valid = (codes1 >= 0) & (codes2 >= 0)
+        cells = (pair_idx * n_rows + codes1) * n_cols + codes2
+        observed = np.bincount(cells[valid], minlength = len(chunk) * n_rows * n_cols).reshape(len(chunk), n_rows, n_cols).astype(float)
+
+        row_totals = observed.sum(axis = 2)
+        col_totals = observed.sum(axis = 1)
+        n = row_totals.sum(axis = 1)
+
+        observed_rows = (row_totals > 0).sum(axis = 1)
+        observed_cols = (col_totals > 0).sum(axis = 1)
+        dof = (observed_rows - 1) * (observed_cols - 1)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            expected = row_totals[:,:,None] * col_totals[:,None,:] / n[:,None,None]
+            observed_levels = expected > 0
+
+            chi2_stat = np.where(observed_levels, (observed - expected) ** 2 / expected, 0).sum(axis = (1,2))
+
+            # Yates' correction for continuity
+            diff = expected - observed
+            corrected = observed + np.where((dof == 1)[:,None,None], np.sign(diff) * np.minimum(.5, np.abs(diff)), 0)
+            statistic = np.where(observed_levels, (corrected - expected) ** 2 / expected, 0).sum(axis = (1,2))
+
+        statistic = np.where(dof == 0, 0., statistic)
+        p = np.where(dof == 0, 1., sp.stats.chi2.sf(statistic, np.maximum(dof, 1)))
+
+        results.append(pd.DataFrame({
+            'question1':[c1 for c1, _ in chunk],
+            'question2':[c2 for _, c2 in chunk],
+            'statistic':statistic,
+            'chi2':chi2_stat,
+            'dof':dof,
+            'p-value':p,
+            'test_result':p <= threshold,
+            'n':n,
+            'n_rows':observed_rows,
+            'n_cols':observed_cols}, index = positions))
+
+    if len(results) == 0:
+        return pd.DataFrame(columns = ['question1','question2','statistic','chi2','dof','p-value','test_result','n','n_rows','n_cols'])
+
+    return pd.concat(results).sort_index().reset_index(drop = True)
+
 def one_way_ANOVA(print_,threshold,*observed):
 
     """
@@ -154,6 +279,146 @@ def kruskal(print_,threshold,*observed):
     return [p, kruskal_result]
 
 
+def group_moments_batch(codes,values,n_levels):
+
+    """
+    Aggregates the group counts, means and sums of squared deviations of many pairs at once with np.bincount.
+
+    Parameters:
+    codes : numpy.ndarray
+        The category codes of the grouping columns, one row per pair (codes must not be negative).
+    values : numpy.ndarray
+        The values of the quantified columns, one row per pair.
+    n_levels : int
+        The number of groups reserved for each pair.
+
+    Returns:
+    tuple
+        The counts, the means and the sums of squared deviations, each an array with one row per pair and one column per group.
+    """
+
+    n_pairs = codes.shape[0]
+    cells = np.arange(n_pairs)[:,None] * n_levels + codes
+
+    count = np.bincount(cells.ravel(), minlength = n_pairs * n_levels).reshape(n_pairs, n_levels)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = np.bincount(cells.ravel(), weights = values.ravel(), minlength = n_pairs * n_levels).reshape(n_pairs, n_levels) / count
+
+    # the squared deviations are taken from the group means in a second pass
+    deviation = values - np.take_along_axis(mean, codes, axis = 1)
+    m2 = np.bincount(cells.ravel(), weights = (deviation ** 2).ravel(), minlength = n_pairs * n_levels).reshape(n_pairs, n_levels)
+
+    return count, mean, m2
+
+def grouped_test_batch(columns,pairs,threshold = .05,chunk_size = 256,moments = None):
+
+    """
+    Performs the one-way ANOVA and the Kruskal-Wallis H-test on many (qualified, quantified) column pairs at once.
+    Both tests share the group aggregates of a chunk of pairs with the same number of categories (see utility.shape_chunks).
+    Each quantified column is ranked once, and the H statistics are corrected for ties.
+    The results are identical to one_way_ANOVA() and kruskal() on the groups of utility.array_split(). A pair with missing values or fewer than two groups gives NaN.
+
+    Parameters:
+    columns : DataFrame or dict
+        The columns, looked up by name.
+    pairs : list
+        A list of (qualified column, quantified column) name pairs.
+    threshold : float, optional
+        The significance level for the tests (default is .05).
+    chunk_size : int, optional
+        The number of pairs aggregated together (default is 256).
+    moments : dict, optional
+        A dict to be filled with the group counts and sums of squared deviations of each pair without missing values,
+        for the Bartlett tests of distribution_test.DistributionPrecheck.precompute().
+
+    Returns:
+    DataFrame
+        A DataFrame with one row per pair in the order of pairs: 'F', 'ANOVA_p-value', 'ANOVA_result', 'H', 'kruskal_p-value', 'kruskal_result' and 'n_groups'.
+    """
+
+    coded = {}
+    ranked = {}
+
+    for c1, c2 in pairs:
+
+        if c1 not in coded:
+            coded[c1] = u.category_codes(columns[c1])
+
+        if c2 not in ranked:
+            values = np.asarray(columns[c2], dtype = float)
+            _, ties = np.unique(values, return_counts = True)
+            ranked[c2] = (values, sp.stats.rankdata(values), (ties ** 3 - ties).sum())
+
+    results = []
+
+    for n_levels, positions in u.shape_chunks([coded[c1][1] for c1, _ in pairs], chunk_size):
+
+        chunk = [pairs[i] for i in positions]
+
+        codes = np.stack([coded[c1][0] for c1, _ in chunk]).astype(np.int64)
+        values = np.stack([ranked[c2][0] for _, c2 in chunk])
+        ranks = np.stack([ranked[c2][1] for _, c2 in chunk])
+        ties = np.array([ranked[c2][2] for _, c2 in chunk], dtype = float)
+
+        invalid = (codes < 0).any(axis = 1) | np.isnan(values).any(axis = 1)
+        codes = np.where(codes < 0, 0, codes)
+
+        count, mean, m2 = group_moments_batch(codes, values, n_levels)
+        rank_count, rank_mean, rank_m2 = group_moments_batch(codes, ranks, n_levels)
+
+        if moments is not None:
+            for pair, pair_invalid, pair_count, pair_m2 in zip(chunk, invalid, count, m2):
+                if pair_invalid == False:
+                    moments[pair] = (pair_count, pair_m2)
+
+        n = values.shape[1]
+        n_groups = (count > 0).sum(axis = 1)
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+            # one-way ANOVA
+            grand_mean = values.mean(axis = 1)
+            ss_between = np.where(count > 0, count * (mean - grand_mean[:,None]) ** 2, 0).sum(axis = 1)
+            ss_within = m2.sum(axis = 1)
+
+            # ranks are exact, so they tell constant groups and constant columns without rounding errors
+            all_constant = (rank_m2 == 0).all(axis = 1)
+            all_same = np.ptp(ranks, axis = 1) == 0
+            ss_within = np.where(all_constant, 0, ss_within)
+
+            F = (ss_between / (n_groups - 1)) / (ss_within / (n - n_groups))
+            F = np.where(all_constant & ~all_same, np.inf, F)
+            F = np.where(all_same, np.nan, F)
+            ANOVA_p = sp.stats.f.sf(F, n_groups - 1, n - n_groups)
+            ANOVA_p = np.where(np.isinf(F), 0, ANOVA_p)
+
+            # Kruskal-Wallis H-test
+            rank_sum = np.where(count > 0, rank_mean * rank_count, 0)
+            H = 12 / (n * (n + 1)) * np.where(count > 0, rank_sum ** 2 / count, 0).sum(axis = 1) - 3 * (n + 1)
+            H = H / (1 - ties / (n ** 3 - n))
+            H = np.where(all_same, np.nan, H)
+            kruskal_p = sp.stats.chi2.sf(H, n_groups - 1)
+
+        unavailable = invalid | (n_groups < 2)
+        F, ANOVA_p, H, kruskal_p = [np.where(unavailable, np.nan, arr) for arr in [F, ANOVA_p, H, kruskal_p]]
+
+        results.append(pd.DataFrame({
+            'question1':[c1 for c1, _ in chunk],
+            'question2':[c2 for _, c2 in chunk],
+            'F':F,
+            'ANOVA_p-value':ANOVA_p,
+            'ANOVA_result':ANOVA_p <= threshold,
+            'H':H,
+            'kruskal_p-value':kruskal_p,
+            'kruskal_result':kruskal_p <= threshold,
+            'n_groups':n_groups}, index = positions))
+
+    if len(results) == 0:
+        return pd.DataFrame(columns = ['question1','question2','F','ANOVA_p-value','ANOVA_result','H','kruskal_p-value','kruskal_result','n_groups'])
+
+    return pd.concat(results).sort_index().reset_index(drop = True)
+
 def t_test(arr1,arr2,test_type,print_,threshold = .05):
 
     """
@@ -210,4 +475,54 @@ def t_test(arr1,arr2,test_type,print_,threshold = .05):
             print('arr2 : {}'.format(arr2.name))
             print('-----------------')
     
-    return [p, ttest_result] 
\ No newline at end of file
+    return [p, ttest_result] 
+
+def welch_t_test_batch(columns,pairs,threshold = .05):
+
+    """
+    Performs Welch's t-test on many pairs of quantified columns at once.
+    The count, mean and variance of each column are computed once, and the t statistics, the Welch-Satterthwaite degrees of freedom and the p-values of all the pairs are derived vectorized.
+    The results are identical to t_test(arr1,arr2,'welch_t',print_) (scipy.stats.ttest_ind with equal_var = False).
+
+    Parameters:
+    columns : DataFrame or dict
+        The quantified columns, looked up by name.
+    pairs : list
+        A list of (column1, column2) name pairs.
+    threshold : float, optional
+        The significance level to determine if the samples can be considered significantly different (default is .05).
+
+    Returns:
+    DataFrame
+        A DataFrame with one row per pair: 'statistic', 'dof', 'p-value' and 'test_result'.
+    """
+
+    names = list(dict.fromkeys(c for pair in pairs for c in pair))
+    position = {name:i for i, name in enumerate(names)}
+
+    # missing values make the moments NaN as scipy does
+    moments = np.array([[len(arr), arr.mean(), arr.var(ddof = 1)] for arr in (np.asarray(columns[name], dtype = float) for name in names)]).reshape(-1, 3)
+    n, mean, var = moments.T
+
+    idx1 = np.array([position[c1] for c1, _ in pairs], dtype = int)
+    idx2 = np.array([position[c2] for _, c2 in pairs], dtype = int)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        vn1 = var[idx1] / n[idx1]
+        vn2 = var[idx2] / n[idx2]
+
+        dof = (vn1 + vn2) ** 2 / (vn1 ** 2 / (n[idx1] - 1) + vn2 ** 2 / (n[idx2] - 1))
+        dof = np.where(np.isnan(dof), 1, dof) # zero variances, any dof gives the same p-value
+
+        statistic = (mean[idx1] - mean[idx2]) / np.sqrt(vn1 + vn2)
+
+    p = 2 * sp.stats.t.sf(np.abs(statistic), dof)
+
+    return pd.DataFrame({
+        'question1':[c1 for c1, _ in pairs],
+        'question2':[c2 for _, c2 in pairs],
+        'statistic':statistic,
+        'dof':dof,
+        'p-value':p,
+        'test_result':p <= threshold})
@@ -8,6 +8,9 @@ Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
 import numpy as np
 import pandas as pd
 import scipy as sp
+import correlation_test as ct
+import result_cache as rc
+import utility as u
 
 def shapiro(observed,print_,threshold = .05):
     """
@@ -159,3 +162,189 @@ def distribution_variance_test(print_,threshold,*observed):
 
     return test_result
 
+
+def bartlett_from_moments(count,m2):
+
+    """
+    Computes Bartlett's statistics and p-values of many pairs at once from their group moments (see correlation_test.group_moments_batch).
+
+    Parameters:
+    count : numpy.ndarray
+        The group counts, one row per pair and one column per group. Empty groups are ignored.
+    m2 : numpy.ndarray
+        The sums of squared deviations from the group means, shaped like count.
+
+    Returns:
+    tuple
+        The statistics and the p-values, as scipy.stats.bartlett() computes them.
+    """
+
+    present = count > 0
+    k = present.sum(axis = 1)
+    n = count.sum(axis = 1)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+
+        ssq = m2 / (count - 1)
+        spsq = np.where(present, (count - 1) * ssq, 0).sum(axis = 1) / (n - k)
+
+        numer = (n - k) * np.log(spsq) - np.where(present, (count - 1) * np.log(ssq), 0).sum(axis = 1)
+        denom = 1 + 1 / (3 * (k - 1)) * (np.where(present, 1 / (count - 1), 0).sum(axis = 1) - 1 / (n - k))
+
+        statistic = numer / denom
+
+    return statistic, sp.stats.chi2.sf(statistic, k - 1)
+
+class DistributionPrecheck:
+
+    """
+    A memo of distribution_variance_test() results keyed by the (grouping column, value column) pair and the fingerprints of their data,
+    so a split which recurs across question combinations or data models is checked only once.
+    The Shapiro-Wilk tests of a pair stop at the first group which fails when nothing is printed,
+    and the Bartlett tests of many pairs are computed at once from group moments, taken from correlation_test.grouped_test_batch() when they are passed to precompute().
+
+    Attributes:
+    -----------
+    threshold : float
+        The significance level for the normality and homogeneity tests.
+    results : dict
+        The memoized results of distribution_variance_test().
+    hits : int
+        The number of results answered from the memo.
+    misses : int
+        The number of results computed.
+
+    Methods:
+    --------
+    key(group_arr, value_arr):
+        Returns the memo key of a pair.
+    precompute(columns, pairs, moments):
+        Runs the prechecks of many pairs at once.
+    test(group_arr, value_arr, arr_list, print_, fingerprints):
+        Returns the memoized result of distribution_variance_test().
+    """
+
+    def __init__(self,threshold = .05):
+
+        self.threshold = threshold
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self,group_arr,value_arr,fingerprints = None):
+
+        """
+        Returns the memo key of a (grouping column, value column) pair. Fingerprints already computed can be passed as a dict keyed by column names.
+        """
+
+        if fingerprints is None:
+            fingerprints = {}
+
+        return (group_arr.name, value_arr.name,
+            fingerprints.get(group_arr.name) or rc.column_fingerprint(group_arr),
+            fingerprints.get(value_arr.name) or rc.column_fingerprint(value_arr))
+
+    def precompute(self,columns,pairs,moments = None):
+
+        """
+        Runs the prechecks of many (grouping column, value column) pairs at once and memoizes them.
+        Pairs with missing values are left to test().
+
+        Parameters:
+        -----------
+        columns : DataFrame or dict
+            The columns, looked up by name.
+        pairs : list
+            A list of (grouping column, value column) name pairs.
+        moments : dict, optional
+            The group counts and sums of squared deviations of the pairs filled by correlation_test.grouped_test_batch(), so they are not computed twice.
+
+        Returns:
+        --------
+        list
+            The results of distribution_variance_test() of the pairs, None for a pair left to test().
+        """
+
+        names = list(dict.fromkeys(c for pair in pairs for c in pair))
+        fingerprints = {name:rc.column_fingerprint(columns[name]) for name in names}
+
+        pending = {}
+
+        for group_name, value_name in pairs:
+
+            key = self.key(columns[group_name],columns[value_name],fingerprints)
+
+            if key in self.results or key in pending:
+                continue
+
+            codes, n_levels = u.category_codes(columns[group_name])
+            values = np.asarray(columns[value_name], dtype = float)
+
+            if (codes < 0).any() or np.isnan(values).any():
+                continue
+
+            # Shapiro-Wilk tests with Bonferroni correction, stopping at the first group which fails
+            arr_list = u.array_split(columns[group_name],columns[value_name])
+            bonferroni_correction = self.threshold / len(arr_list)
+            shapiro_test_result = all(shapiro(arr,False,bonferroni_correction)[1] for arr in arr_list)
+
+            pending[key] = (shapiro_test_result, codes, values, n_levels, (group_name, value_name))
+            self.misses += 1
+
+        # Bartlett tests of the normally distributed pairs at once
+        passed = [key for key, (shapiro_test_result, _, _, _, _) in pending.items() if shapiro_test_result == True]
+
+        for n_levels in set(pending[key][3] for key in passed):
+
+            keys = [key for key in passed if pending[key][3] == n_levels]
+
+            if moments is not None and all(pending[key][4] in moments for key in keys):
+                count = np.stack([moments[pending[key][4]][0] for key in keys])
+                m2 = np.stack([moments[pending[key][4]][1] for key in keys])
+            else:
+                count, _, m2 = ct.group_moments_batch(np.stack([pending[key][1] for key in keys]).astype(np.int64),np.stack([pending[key][2] for key in keys]),n_levels)
+
+            _, p = bartlett_from_moments(count,m2)
+
+            for key, bartlett_p in zip(keys,p):
+                self.results[key] = [True, [bartlett_p, not bartlett_p <= self.threshold]]
+
+        for key, (shapiro_test_result, _, _, _, _) in pending.items():
+            if shapiro_test_result == False:
+                self.results[key] = [False, np.nan]
+
+        return [self.results.get(self.key(columns[group_name],columns[value_name],fingerprints)) for group_name, value_name in pairs]
+
+    def test(self,group_arr,value_arr,arr_list,print_,fingerprints = None):
+
+        """
+        Returns the result of distribution_variance_test() on the groups of a pair, from the memo when the pair was already checked.
+        The test is always run when print_ is True so that its messages are printed.
+
+        Parameters:
+        -----------
+        group_arr : pandas.Series
+            The grouping (qualified) column.
+        value_arr : pandas.Series
+            The value (quantified) column.
+        arr_list : list
+            The groups of value_arr split by group_arr (see utility.array_split).
+        fingerprints : dict, optional
+            The fingerprints of the columns already computed, keyed by column names.
+
+        Returns:
+        --------
+        list
+            The Shapiro-Wilk and Bartlett test results.
+        """
+
+        key = self.key(group_arr,value_arr,fingerprints)
+
+        if print_ == False and key in self.results:
+            self.hits += 1
+            return self.results[key]
+
+        self.misses += 1
+        self.results[key] = distribution_variance_test(print_,self.threshold,*arr_list)
+
+        return self.results[key]
@@ -5,19 +5,27 @@ Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
 """
 
 # load the libraries
+import argparse
+import hashlib
 import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import config_operation as co
 import a_data_process as a
 import b_stats_approach as b
+import result_cache as rc
+import result_sink as rs
+import shared_data as sd
+import utility as u
 import c_viz as c
 from langchain_community.vectorstores import FAISS,Chroma
 import d_chatgpt as d
 
 
 # parameters
-file_paths= ['dataset\\2020_rws.csv','dataset\\2021_rws.csv']
+file_paths= [os.path.join('dataset','2020_rws.csv'),os.path.join('dataset','2021_rws.csv')]
 ym = co.YamlManager('parameters.yaml')
 questions = ym.read_yaml()
 ym2 = co.YamlManager('scales.yaml')
@@ -27,23 +35,114 @@ threshold = d.threshold
 
 
 # read the dataset
-def load_raw_data(file_paths):
+def load_raw_data(file_paths,cache_dir = None):
 
     rawdata_list = []
 
     for fp in file_paths:
-        rawdata = a.D(fp,'cp1252')
+        rawdata = a.D(fp,'cp1252',cache_dir = cache_dir)
         data = rawdata.del_white_space_col(inplace = True)
         rawdata_list.append(data)
 
     return rawdata_list[0],rawdata_list[1]
 
-def main_process(df,likert_scale,missing_allowance = .1,fill_qualified_constant_value = 'Empty'):
+def load_projected_data(file_paths,questions,target_data_models,cache_dir = None):
+
+    """
+    Reads only the original question columns of the target data models (plus Response ID).
+
+    Parameters:
+    -----------
+    file_paths : list
+        The file paths of the 2020 and 2021 datasets.
+    questions : dict
+        The common questions loaded from parameters.yaml.
+    target_data_models : list
+        The data models to be analysed, e.g. ['TMS','WPB'].
+    cache_dir : str, optional
+        A directory for Arrow snapshots of the cleaned DataFrames.
+
+    Returns:
+    --------
+    tuple
+        The projected 2020 and 2021 DataFrames followed by the 2020 and 2021 question DataFrames of the full header.
+    """
+
+    rawdata_list = []
+    questions_list = []
+
+    for year_idx, fp in enumerate(file_paths):
+
+        header = a.D.read_header(fp,'cp1252')
+        questions_list.append(a.D.get_questions_as_df(pd.DataFrame(columns = header)))
+
+        original_ids = a.Q.get_original_ids(questions,target_data_models,year_idx)
+        usecols = [0] + [i + 1 for i in original_ids] # original IDs do not count Response ID
+
+        rawdata = a.D(fp,'cp1252',cache_dir = cache_dir,usecols = usecols)
+        data = rawdata.del_white_space_col(inplace = True)
+        rawdata_list.append(data)
+
+    return rawdata_list[0],rawdata_list[1],questions_list[0],questions_list[1]
+
+def main_process(df,likert_scale,missing_allowance = .1,fill_qualified_constant_value = 'Empty',encode = False):
 
     df = a.D.replacement(df,likert_scale)
     df = a.D.main_impute(df,missing_allowance,fill_qualified_constant_value)
+
+    if encode == True:
+        df = a.D.encode_qualified(df)
+
     return df
 
+def pair_shard(q1,q2,n_shards):
+
+    """
+    Assigns a pair of original questions to one of n_shards shards.
+    The shard depends only on the unordered pair, so every machine assigns a pair to the same shard without coordination.
+
+    Parameters:
+    -----------
+    q1, q2 : str
+        The original questions of the pair.
+    n_shards : int
+        The number of shards.
+
+    Returns:
+    --------
+    int
+        The shard of the pair, from 0 to n_shards - 1.
+    """
+
+    canonical_pair = (q1,q2) if q1 <= q2 else (q2,q1)
+    digest = hashlib.md5('\x1f'.join(canonical_pair).encode('utf-8')).hexdigest() # unlike hash(), md5 does not change between processes
+
+    return int(digest,16) % n_shards
+
+def parse_shard(text):
+
+    """
+    Parses a shard given as 'i/N', e.g. '0/4' for the first of four shards.
+    """
+
+    try:
+        index, n_shards = (int(v) for v in text.split('/'))
+    except ValueError:
+        raise ValueError('A shard must be given as i/N, e.g. 0/4: {}'.format(text))
+
+    if n_shards < 1 or not 0 <= index < n_shards:
+        raise ValueError('The shard index must be from 0 to N - 1: {}'.format(text))
+
+    return index, n_shards
+
+def shard_file_path(output,shard):
+
+    """
+    Returns the file path of the results of a shard, e.g. 'results_shard0of4.csv' for output 'results' and shard (0,4).
+    """
+
+    return '{}_shard{}of{}.csv'.format(output,shard[0],shard[1])
+
 
 class main(a.Q):
 
@@ -92,12 +191,140 @@ class main(a.Q):
 
         return common_q_comb
     
-    def execute(self,common_q_comb,likert_scale,y, printing):
+    def plan_pairs(self,common_q_comb = None,year = '2021',shard = None):
 
         """
-        Retrieves a dictionary containing six Data Frames based each common question ID --> target_qids_dfs
-        Create pairs of original questions --> q_comb
-        Retrieves results in the statistic tests --> result_list
+        Lazily yields each unordered pair of original questions exactly once across all the common question ID pairs.
+        Pairs of a question with itself (the '_duplicated' aliases) are skipped, and a pair already yielded in the other orientation is not repeated.
+        The numbers of yielded and pruned pairs are kept in self.pair_report.
+
+        Parameters:
+        -----------
+        common_q_comb : iterable, optional
+            The common question ID pairs. If None (default), they are generated lazily from target_data_models.
+        year : str
+            The year whose original questions are paired ('2020' or '2021').
+        shard : tuple, optional
+            (i, N) to yield only the pairs of the i-th of N shards --> pair_shard
+            The pairs keep the orientation and the order they have in the whole plan.
+
+        Yields:
+        -------
+        tuple
+            A pair of original questions.
+        """
+
+        if common_q_comb is None:
+            common_q_comb = itertools.product(self.model_index.get(self.target_data_models[0],()),self.model_index.get(self.target_data_models[1],()))
+
+        self.pair_report = {'yielded':0,'same question ID':0,'self pair':0,'repeated pair':0}
+
+        if shard is not None:
+            self.pair_report['other shard'] = 0
+
+        idx = ['2020','2021'].index(year)
+        seen = set()
+
+        for qid1, qid2 in common_q_comb:
+
+            if qid1 == qid2:
+                self.pair_report['same question ID'] += 1
+                continue
+
+            for q1 in dict.fromkeys(self.original_columns[qid1][idx]):
+                for q2 in dict.fromkeys(self.original_columns[qid2][idx]):
+
+                    if q1 == q2:
+                        self.pair_report['self pair'] += 1
+                        continue
+
+                    canonical_pair = (q1,q2) if q1 <= q2 else (q2,q1)
+
+                    if canonical_pair in seen:
+                        self.pair_report['repeated pair'] += 1
+                        continue
+
+                    seen.add(canonical_pair)
+
+                    if shard is not None and pair_shard(q1,q2,shard[1]) != shard[0]:
+                        self.pair_report['other shard'] += 1
+                        continue
+
+                    self.pair_report['yielded'] += 1
+
+                    yield q1, q2
+
+    def dump_plan(self,common_q_comb,likert_scale,y,catalog = None,file_path = None):
+
+        """
+        Assigns each unique pair of original questions its statistical test and correlation measure without computing them --> b.compile_plan
+        Prints the number of pairs per route to estimate the cost of execute() --> b.plan_summary
+
+        Parameters:
+        -----------
+        catalog : utility.ColumnCatalog, optional
+            The column profiles of the dataset. Each column of the pairs is profiled once if not given.
+        file_path : str, optional
+            A CSV file to write the plan into.
+
+        Returns: 
+        --------
+        DataFrame
+            The plan with one row per pair
+        """
+
+        q_comb = list(self.plan_pairs(common_q_comb,y)) # create the unique pairs of original questions
+
+        questions = list(dict.fromkeys(q for comb_idx in q_comb for q in comb_idx))
+        columns = {q:self.pair_arrays(y,q,q)[0] for q in questions}
+
+        if catalog is None:
+            catalog = u.ColumnCatalog(likert_scale)
+
+        plan = b.compile_plan(q_comb,columns,catalog)
+
+        print('The question pairs: {}'.format(self.pair_report))
+        print(b.plan_summary(plan))
+
+        if file_path is not None:
+            plan.to_csv(file_path,index = False)
+
+        return plan
+
+    def execute(self,common_q_comb,likert_scale,y, printing,cache = None,precheck = None,catalog = None,workers = 1,chunksize = 256,shard = None,checkpoint = None,sink = None):
+
+        """
+        Create the unique pairs of original questions --> plan_pairs
+        Retrieves the two columns of each pair as views of the survey DataFrame --> pair_arrays
+        Profiles each column of the pairs once --> catalog
+        Assigns each pair its statistical test and correlation measure, and runs the pairs of each route in a batch --> b.compile_plan, b.run_plan
+        With several workers, the encoded columns are published into shared memory once,
+        and the chunks of the plan run on a process pool and are merged in order --> sd.SharedSurvey, b.init_worker, b.run_chunk
+        When printing, the pairs are tested one by one with the correlation measures computed at once --> b.build_lookup, b.main
+        With a checkpoint, the completed pairs are skipped and the others run in chunks whose results are appended to it --> rc.PairResultLog
+        Retrieves results in the statistic tests, from the cache when given, into a typed store --> rs.ResultSink
+
+        Parameters:
+        -----------
+        cache : result_cache.PairResultCache, optional
+            An on-disk cache of pair results shared by the runs of different target_data_models.
+        precheck : distribution_test.DistributionPrecheck, optional
+            A memo of the distribution prechecks shared by the runs of different target_data_models.
+        catalog : utility.ColumnCatalog, optional
+            The column profiles of the dataset. Each column of the pairs is profiled once if not given.
+        workers : int
+            The number of worker processes (default is 1, no process pool). Ignored when printing.
+            The pairs which fail in a worker are left out of the results and kept in self.pair_errors.
+            The results are the same as those of a serial run, whatever workers and chunksize.
+        chunksize : int
+            The number of pairs sent to a worker, or written to the checkpoint, at once.
+        shard : tuple, optional
+            (i, N) to run only the pairs of the i-th of N shards, e.g. on one of N machines --> plan_pairs, merge_shards
+        checkpoint : result_cache.PairResultLog, optional
+            An append-only log the results are written to chunk by chunk, so that a stopped run can be resumed.
+            The pairs already in the log for the same configuration and data are not run again.
+        sink : result_sink.ResultSink, optional
+            A typed store the results are also appended to, e.g. shared by the runs of different target_data_models and written to Parquet at the end.
                 
         Returns: 
         --------
@@ -105,21 +332,143 @@ class main(a.Q):
             A df containing the results in the statistic test
         """
 
-        collection = []
+        self.pair_errors = []
+
+        q_comb = list(self.plan_pairs(common_q_comb,y,shard)) # create the unique pairs of original questions
+
+        questions = list(dict.fromkeys(q for comb_idx in q_comb for q in comb_idx))
+        columns = {q:self.pair_arrays(y,q,q)[0] for q in questions}
+
+        if catalog is None:
+            catalog = u.ColumnCatalog(likert_scale)
+
+        completed = {}
+        pending = q_comb
+
+        if checkpoint is not None: # skip the pairs completed by a previous run of the same configuration
+
+            pair_keys = dict(zip(q_comb,checkpoint.pair_keys(q_comb,columns,y,.05,likert_scale)))
+            completed = {comb_idx:checkpoint.completed[key] for comb_idx, key in pair_keys.items() if key in checkpoint.completed}
+            pending = [comb_idx for comb_idx in q_comb if comb_idx not in completed]
+
+            print('The completed pairs in the checkpoint: {}'.format(len(completed)))
+
+        results = rs.ResultSink()
+
+        def record(chunk_results):
+
+            # the results of a chunk are written to the checkpoint as soon as the chunk completes
+            if checkpoint is not None:
+                checkpoint.append([pair_keys[(row[0],row[1])] for row in chunk_results],chunk_results)
+
+            results.append(chunk_results)
+
+        # without a checkpoint, the pairs run at once so that the batches are as large as possible
+        # the results of a pair do not depend on its chunk, so a checkpointed or resumed run gives the same numbers
+        step = chunksize if checkpoint is not None else max(len(pending),1)
+
+        if printing == True: # the batched kernels print nothing
+
+            if len(pending) > 0:
+                lookup = b.build_lookup(columns,pending,likert_scale,precheck,catalog) # batch the correlation measures
+
+                for start in range(0,len(pending),step):
+                    record(b.main(id = self.id,q_comb = pending[start:start + step],target_qids_dfs = lambda years, q1, q2: (columns[q1], columns[q2]),years = y,print_ = printing,threshold=.05,likert_scale=likert_scale,cache = cache,lookup = lookup,precheck = precheck,catalog = catalog)) # carry out the statistic approach on the column views
+
+        elif workers > 1:
+
+            plan = b.compile_plan(pending,columns,catalog) # group the pairs by route
+            chunks = [plan.iloc[start:start + chunksize] for start in range(0,len(plan),chunksize)]
+            cache_file_path = cache.file_path if cache is not None else None
+
+            try:
+                shared = sd.SharedSurvey.publish(columns) # the workers attach to the encoded columns without copying them
+            except ValueError:
+                shared = None # qualified columns which are not encoded are pickled to each worker once
+
+            try:
+
+                # the columns are shipped once to each worker, and map() returns the chunks in order
+                with ProcessPoolExecutor(max_workers = workers,initializer = b.init_worker,initargs = (columns if shared is None else shared,y,.05,likert_scale,catalog,cache_file_path)) as executor:
+
+                    for chunk_results, chunk_errors in executor.map(b.run_chunk,chunks):
+                        record(chunk_results)
+                        self.pair_errors += chunk_errors
+
+            finally:
+
+                if shared is not None:
+                    shared.close()
+                    shared.unlink()
+
+            if len(self.pair_errors) > 0:
+                print('The failed pairs: {}'.format(len(self.pair_errors)))
+
+        else:
+
+            plan = b.compile_plan(pending,columns,catalog) # group the pairs by route
+
+            for start in range(0,len(plan),step):
+                record(b.run_plan(plan.iloc[start:start + step].reset_index(drop = True),columns,y,.05,likert_scale,cache = cache,precheck = precheck,catalog = catalog)) # carry out the statistic approach route by route
+
+        if len(completed) > 0: # put the completed pairs back in the order of the plan
+            results.append([list(comb_idx) + row[2:] for comb_idx, row in completed.items()])
+            results.reorder(q_comb)
+
+        collection_df = results.to_frame()
+
+        if sink is not None:
+            sink.extend(results)
+
+        print('The question pairs: {}'.format(self.pair_report))
+
+        return collection_df
+
+    def merge_shards(self,file_paths,common_q_comb = None,year = '2021'):
+
+        """
+        Combines the results of the shards written by separate runs of execute(shard = (i, N)) --> shard_file_path
+        Checks that every pair of the whole plan appears exactly once, and restores the order of a single run --> plan_pairs
+
+        Parameters:
+        -----------
+        file_paths : list
+            The CSV files of the results of the shards.
+        common_q_comb : iterable, optional
+            The common question ID pairs given to execute().
+        year : str
+            The year given to execute() as y ('2020' or '2021').
+
+        Returns:
+        --------
+        DataFrame
+            A df containing the results in the statistic test, as returned by execute() without shards
+        """
+
+        shard_dfs = [pd.read_csv(fp,float_precision = 'round_trip') for fp in file_paths] # keep the floats exactly
+        merged = pd.concat(shard_dfs,ignore_index = True)
+
+        q_comb = list(self.plan_pairs(common_q_comb,year))
 
-        for cqm in common_q_comb:
+        # a pair is the same in either orientation
+        expected = {(q1,q2) if q1 <= q2 else (q2,q1) for q1, q2 in q_comb}
+        keys = pd.Series([(q1,q2) if q1 <= q2 else (q2,q1) for q1, q2 in zip(merged['question1'],merged['question2'])],dtype = object)
 
-            if cqm[0] != cqm[1]:
+        found = set(keys)
+        duplicated = list(dict.fromkeys(keys[keys.duplicated()]))
+        missing = [(q1,q2) for q1, q2 in q_comb if ((q1,q2) if q1 <= q2 else (q2,q1)) not in found]
+        unexpected = [pair for pair in dict.fromkeys(keys) if pair not in expected]
 
-                target_qids_dfs = self.two_qids_dfs(cqm[0],cqm[1]) # get a dict containing six DataFrames related to the original question columns and Response ID
-                q_comb = self.question_combination('2021',target_qids_dfs,suffix = '_duplicated') # create pairs of original questions
+        if len(duplicated) > 0 or len(missing) > 0 or len(unexpected) > 0:
+            raise ValueError('The shards do not cover the pairs exactly once: {} missing, {} duplicated and {} unexpected pairs, e.g. {}'.format(
+                len(missing),len(duplicated),len(unexpected),(missing + duplicated + unexpected)[:3]))
 
-                result_list = b.main(id = self.id,q_comb = q_comb,target_qids_dfs = target_qids_dfs,years = y,print_ = printing,threshold=.05,likert_scale=likert_scale) # carry out the statistic approach
-                result_df = pd.DataFrame(result_list,columns = ['question1','question2','test_p-value','test_result','corr','corr_p-value','corr_test'])
-                collection.append(result_df)
+        # reorder the rows as in a single run
+        position = {((q1,q2) if q1 <= q2 else (q2,q1)):i for i, (q1, q2) in enumerate(q_comb)}
+        order = np.argsort(keys.map(position).values,kind = 'stable')
+        collection_df = merged.iloc[order].reset_index(drop = True)
 
-        collection_df = pd.concat(collection)
-        collection_df = collection_df.drop_duplicates()
+        print('The merged shards: {} files, {} pairs'.format(len(file_paths),len(collection_df)))
 
         return collection_df
 
@@ -200,4 +549,39 @@ def chatgpt(pdf_path,query,threshold):
     ex.prompt_engineer()
     ex.retrievalQA()
     res2 = ex.chat_query_retrievalQA(query)
-    return res1, res2
\ No newline at end of file
+    return res1, res2
+
+
+if __name__ == '__main__':
+
+    # e.g. python main.py TMS WPB --shard 0/4 --output results   (one run per machine)
+    #      python main.py TMS WPB --merge results_shard*of4.csv --output results
+    parser = argparse.ArgumentParser(description = 'Runs the statistic approach on the question pairs of two data models.')
+    parser.add_argument('target_data_models',nargs = 2,help = 'the two data models, e.g. TMS WPB')
+    parser.add_argument('--data',default = 'dataset',help = 'the directory of 2020_rws.csv and 2021_rws.csv')
+    parser.add_argument('--year',default = '2021',choices = ['2020','2021'],help = 'the year of the dataset to test')
+    parser.add_argument('--shard',type = parse_shard,default = None,help = 'i/N to run only the i-th of N shards of the pairs')
+    parser.add_argument('--merge',nargs = '+',default = None,help = 'the result files of the shards to merge instead of running')
+    parser.add_argument('--output',default = 'collection',help = 'the file path of the results without the extension')
+    parser.add_argument('--workers',type = int,default = 1,help = 'the number of worker processes')
+    parser.add_argument('--checkpoint',default = None,help = 'a JSON lines file to resume the run from and write the completed pairs to')
+    args = parser.parse_args()
+
+    data_file_paths = [os.path.join(args.data,'2020_rws.csv'),os.path.join(args.data,'2021_rws.csv')]
+    rws_2020, rws_2021, questions_2020, questions_2021 = load_projected_data(data_file_paths,questions,args.target_data_models)
+    rws_2020 = main_process(rws_2020,likert_scale,encode = True)
+    rws_2021 = main_process(rws_2021,likert_scale,encode = True)
+
+    m = main(args.target_data_models,questions,questions_2020,questions_2021,rws_2020,rws_2021)
+    common_q_comb = m.get_common_qs()
+
+    if args.merge is not None:
+        collection_df = m.merge_shards(args.merge,common_q_comb,args.year)
+        output_path = '{}.csv'.format(args.output)
+    else:
+        checkpoint = rc.PairResultLog(args.checkpoint) if args.checkpoint is not None else None
+        collection_df = m.execute(common_q_comb,likert_scale,y = args.year,printing = False,workers = args.workers,shard = args.shard,checkpoint = checkpoint)
+        output_path = shard_file_path(args.output,args.shard) if args.shard is not None else '{}.csv'.format(args.output)
+
+    collection_df.to_csv(output_path,index = False)
+    print('The results: {}'.format(output_path))
@@ -0,0 +1,272 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+def column_fingerprint(arr):
+
+    """
+    Computes a digest of the values of a column. Equal values give the same digest whether the column is categorical or not.
+
+    Parameters:
+    arr : pandas.Series
+        The column to hash.
+
+    Returns:
+    str
+        The hexadecimal digest.
+    """
+
+    hashed = pd.util.hash_pandas_object(arr, index = False).values
+
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+def config_fingerprint(threshold,likert_scale):
+
+    """
+    Computes a digest of the test configuration of b_stats_approach.main().
+
+    Parameters:
+    threshold : float
+        The significance level for statistical tests.
+    likert_scale : dict
+        The mapping from answers to scores.
+
+    Returns:
+    str
+        The hexadecimal digest.
+    """
+
+    config = json.dumps({'threshold':threshold, 'likert_scale':sorted(likert_scale.items())}, sort_keys = True)
+
+    return hashlib.sha1(config.encode()).hexdigest()
+
+class PairResultCache:
+
+    """
+    An on-disk cache of the results of b_stats_approach.main() for question pairs, stored in a SQLite file.
+    An entry is keyed by the unordered column pair, the year, the test configuration and the fingerprints of both columns,
+    so a pair shared by several data models is tested only once. The cache holds at most max_entries entries and evicts the least recently used ones.
+    The lookups and new results are buffered and written in one transaction by flush(), e.g. once per chunk of pairs,
+    and the file is opened in WAL mode so that worker processes can share it.
+
+    Attributes:
+    -----------
+    file_path : str
+        The file path to the SQLite file.
+    max_entries : int
+        The maximum number of entries.
+    timeout : float
+        The number of seconds to wait for another process to release the file.
+    hits : int
+        The number of lookups answered from the cache.
+    misses : int
+        The number of lookups not found in the cache.
+
+    Methods:
+    --------
+    key(question1, question2, year, config, fingerprint1, fingerprint2):
+        Returns the key of a pair result.
+    get(key):
+        Returns the cached result or None.
+    put(key, result):
+        Buffers a result.
+    flush():
+        Writes the buffered results and lookups, and evicts the least recently used entries beyond max_entries.
+    """
+
+    def __init__(self,file_path,max_entries = 100000,timeout = 60):
+
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.pending = {} # the results not written yet
+        self.touched = {} # the times of the lookups not written yet
+
+        self.connection = sqlite3.connect(file_path,timeout = timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL') # readers do not block the writer of another process
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, last_used INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self.connection.commit()
+
+        self.size = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    @staticmethod
+    def key(question1,question2,year,config,fingerprint1,fingerprint2):
+
+        """
+        Returns the key of a pair result. The key does not depend on the order of the questions.
+        """
+
+        pair = sorted([(question1,fingerprint1),(question2,fingerprint2)])
+
+        return hashlib.sha1(json.dumps([pair,year,config]).encode()).hexdigest()
+
+    def get(self,key):
+
+        """
+        Returns the cached result of a key, or None if it is not cached.
+        """
+
+        if key in self.pending:
+            self.hits += 1
+            return json.loads(self.pending[key])
+
+        row = self.connection.execute('SELECT result FROM results WHERE key = ?',(key,)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touched[key] = time.time_ns()
+
+        return json.loads(row[0])
+
+    def put(self,key,result):
+
+        """
+        Buffers a result until the next flush().
+        """
+
+        result = [v.item() if isinstance(v, np.generic) else v for v in result]
+
+        self.pending[key] = json.dumps(result)
+
+    def flush(self):
+
+        """
+        Writes the buffered results and lookup times in one transaction.
+        The least recently used tenth of the entries is evicted when the cache exceeds max_entries.
+        """
+
+        if len(self.pending) == 0 and len(self.touched) == 0:
+            return
+
+        now = time.time_ns()
+
+        with self.connection: # one commit
+
+            cursor = self.connection.executemany('INSERT OR IGNORE INTO results VALUES (?,?,?)',[(key,result,now) for key, result in self.pending.items()])
+            self.size += max(cursor.rowcount,0)
+
+            self.connection.executemany('UPDATE results SET last_used = ? WHERE key = ?',[(last_used,key) for key, last_used in self.touched.items()])
+
+            if self.size > self.max_entries:
+                evicted = self.size - self.max_entries + self.max_entries // 10
+                self.connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used ASC LIMIT ?)',(evicted,))
+                self.size = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+        self.pending = {}
+        self.touched = {}
+
+    def close(self):
+
+        self.flush()
+        self.connection.close()
+
+class PairResultLog:
+
+    """
+    An append-only checkpoint of the results of main.execute(), stored as JSON lines.
+    Each line holds the key of a pair (see PairResultCache.key) and its result row, and is written as soon as its chunk of pairs completes,
+    so a run which stops halfway can be resumed: a rerun with the same configuration and data skips the pairs already in the log.
+    A last line cut off by a crash is ignored.
+
+    Attributes:
+    -----------
+    file_path : str
+        The file path to the JSON lines file.
+    completed : dict
+        The result rows of the completed pairs keyed by their keys.
+
+    Methods:
+    --------
+    pair_keys(q_comb, columns, year, threshold, likert_scale):
+        Returns the key of each pair.
+    append(keys, result_list):
+        Writes the result rows of completed pairs to the end of the log.
+    """
+
+    def __init__(self,file_path):
+
+        self.file_path = file_path
+        self.completed = {}
+
+        if os.path.exists(file_path):
+
+            with open(file_path,'r',encoding = 'utf-8') as f:
+                lines = f.read().split('\n')
+
+            for line in lines:
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # an empty or cut off line
+
+                self.completed[record['key']] = record['result']
+
+            if len(lines[-1]) > 0: # start the next record on a new line after a cut off one
+                with open(file_path,'a',encoding = 'utf-8') as f:
+                    f.write('\n')
+
+    @staticmethod
+    def pair_keys(q_comb,columns,year,threshold,likert_scale):
+
+        """
+        Returns the key of each pair, which changes with the configuration of the tests and the data of both columns.
+
+        Parameters:
+        -----------
+        q_comb : list
+            The question pairs.
+        columns : dict
+            The column of each question.
+        year : str
+            The year of the dataset.
+        threshold : float
+            The significance level for statistical tests.
+        likert_scale : dict
+            The mapping from answers to scores.
+
+        Returns:
+        --------
+        list
+            The keys in the order of q_comb.
+        """
+
+        config = config_fingerprint(threshold,likert_scale)
+        fingerprints = {q:column_fingerprint(columns[q]) for q in dict.fromkeys(q for comb_idx in q_comb for q in comb_idx)}
+
+        return [PairResultCache.key(q1,q2,year,config,fingerprints[q1],fingerprints[q2]) for q1, q2 in q_comb]
+
+    def append(self,keys,result_list):
+
+        """
+        Writes the result rows of completed pairs to the end of the log and flushes them to disk.
+        """
+
+        lines = []
+
+        for key, result in zip(keys,result_list):
+            result = [v.item() if isinstance(v, np.generic) else v for v in result]
+            self.completed[key] = result
+            lines.append(json.dumps({'key':key,'result':result}) + '\n')
+
+        with open(self.file_path,'a',encoding = 'utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,236 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+class ResultSink:
+
+    """
+    An append-only, typed store of the results of the statistic approach, i.e. the rows [question1, question2, test_p-value, test_result, corr, corr_p-value, corr_test]
+    returned by b_stats_approach.main() and b_stats_approach.run_plan().
+    The questions and the names of the correlation measures are interned as integer IDs, the p-values and correlations are kept as float64,
+    and test_result as int8 (1 True, 0 False, -1 missing). The columns are numpy arrays allocated chunk by chunk,
+    so appending does not copy the results already stored, and the store is concatenated once when it is read.
+
+    Attributes:
+    -----------
+    chunk_size : int
+        The number of rows allocated at once.
+    questions : dict
+        The ID of each question.
+    corr_tests : dict
+        The ID of each name of a correlation measure.
+
+    Methods:
+    --------
+    append(result_list):
+        Appends result rows.
+    extend(sink):
+        Appends the rows of another sink.
+    reorder(q_comb):
+        Sorts the rows in the order of the question pairs.
+    to_frame() / to_arrow():
+        Returns the rows as a DataFrame like collection_df / as an Arrow table with dictionary-encoded strings.
+    write_parquet(file_path) / write_feather(file_path):
+        Writes the rows into a Parquet / Arrow (Feather) file.
+    """
+
+    columns = ['question1','question2','test_p-value','test_result','corr','corr_p-value','corr_test']
+    dtypes = {'question1':np.int32,'question2':np.int32,'test_p-value':np.float64,'test_result':np.int8,'corr':np.float64,'corr_p-value':np.float64,'corr_test':np.int16}
+
+    def __init__(self,chunk_size = 65536):
+
+        self.chunk_size = chunk_size
+        self.questions = {}
+        self.corr_tests = {}
+        self.chunks = [] # the full chunks
+        self.current = self.new_chunk()
+        self.n_current = 0
+
+    def new_chunk(self):
+
+        return {c:np.empty(self.chunk_size,dtype = dtype) for c, dtype in self.dtypes.items()}
+
+    def __len__(self):
+
+        return len(self.chunks) * self.chunk_size + self.n_current
+
+    @staticmethod
+    def intern(table,values):
+
+        """
+        Returns the IDs of values in table, adding the values not in it yet.
+        """
+
+        return [table.setdefault(v,len(table)) for v in values]
+
+    @staticmethod
+    def encode_test_result(v):
+
+        if v is None or (isinstance(v, float) and np.isnan(v)):
+            return -1
+
+        return int(bool(v))
+
+    def append(self,result_list):
+
+        """
+        Appends result rows, e.g. a chunk returned by b_stats_approach.run_plan().
+
+        Parameters:
+        -----------
+        result_list : list
+            The rows [question1, question2, test_p-value, test_result, corr, corr_p-value, corr_test].
+        """
+
+        if len(result_list) == 0:
+            return
+
+        q1s, q2s, test_ps, test_results, corrs, corr_ps, corr_tests = zip(*result_list)
+
+        self.append_arrays({'question1':np.array(self.intern(self.questions,q1s),dtype = np.int32),
+                            'question2':np.array(self.intern(self.questions,q2s),dtype = np.int32),
+                            'test_p-value':np.array(test_ps,dtype = np.float64),
+                            'test_result':np.array([self.encode_test_result(v) for v in test_results],dtype = np.int8),
+                            'corr':np.array(corrs,dtype = np.float64),
+                            'corr_p-value':np.array(corr_ps,dtype = np.float64),
+                            'corr_test':np.array(self.intern(self.corr_tests,corr_tests),dtype = np.int16)})
+
+    def append_arrays(self,arrays):
+
+        """
+        Copies encoded columns of the same length into the chunks, allocating a new chunk whenever the current one is full.
+        """
+
+        n = len(arrays['question1'])
+        start = 0
+
+        while start < n:
+
+            size = min(n - start,self.chunk_size - self.n_current)
+
+            for c in self.dtypes:
+                self.current[c][self.n_current:self.n_current + size] = arrays[c][start:start + size]
+
+            self.n_current += size
+            start += size
+
+            if self.n_current == self.chunk_size:
+                self.chunks.append(self.current)
+                self.current = self.new_chunk()
+                self.n_current = 0
+
+    def arrays(self):
+
+        """
+        Returns the encoded columns as contiguous arrays.
+        """
+
+        return {c:np.concatenate([chunk[c] for chunk in self.chunks] + [self.current[c][:self.n_current]]) for c in self.dtypes}
+
+    def extend(self,sink):
+
+        """
+        Appends the rows of another sink, e.g. the results of the run of another target_data_models, translating its IDs into the IDs of this sink.
+        """
+
+        arrays = sink.arrays()
+
+        for c, table, other_table in [('question1',self.questions,sink.questions),('question2',self.questions,sink.questions),('corr_test',self.corr_tests,sink.corr_tests)]:
+            mapping = np.array(self.intern(table,other_table),dtype = self.dtypes[c])
+            arrays[c] = mapping[arrays[c]] if len(mapping) > 0 else arrays[c]
+
+        self.append_arrays(arrays)
+
+    def reorder(self,q_comb):
+
+        """
+        Sorts the rows in the order of the question pairs in q_comb. The rows of pairs not in q_comb come last.
+        """
+
+        arrays = self.arrays()
+
+        position = {}
+        for i, (q1, q2) in enumerate(q_comb):
+            if q1 in self.questions and q2 in self.questions:
+                position[(self.questions[q1],self.questions[q2])] = i
+
+        keys = [position.get(pair,len(q_comb)) for pair in zip(arrays['question1'].tolist(),arrays['question2'].tolist())]
+        order = np.argsort(np.array(keys,dtype = np.int64),kind = 'stable')
+
+        self.chunks = []
+        self.current = self.new_chunk()
+        self.n_current = 0
+        self.append_arrays({c:values[order] for c, values in arrays.items()})
+
+    def to_frame(self,categorical = False):
+
+        """
+        Returns the rows as a DataFrame with the columns of collection_df.
+
+        Parameters:
+        -----------
+        categorical : bool
+            Whether the questions and the correlation measures are returned as categorical columns (default is False, strings as in collection_df).
+
+        Returns:
+        --------
+        DataFrame
+            A df containing the results in the statistic test
+        """
+
+        arrays = self.arrays()
+        question_names = list(self.questions)
+        corr_test_names = list(self.corr_tests)
+
+        df = pd.DataFrame({c:arrays[c] for c in ['test_p-value','corr','corr_p-value']})
+
+        for c, names in [('question1',question_names),('question2',question_names),('corr_test',corr_test_names)]:
+            values = pd.Categorical.from_codes(arrays[c],categories = names) if len(names) > 0 else pd.Categorical([],categories = [])
+            df[c] = values if categorical == True else np.asarray(values,dtype = object)
+
+        # a missing test result is NaN as in the lists of b_stats_approach.main()
+        test_result = arrays['test_result']
+        if (test_result == -1).any():
+            values = np.array((test_result == 1).tolist(),dtype = object)
+            values[test_result == -1] = np.nan
+            df['test_result'] = values
+        else:
+            df['test_result'] = test_result == 1
+
+        return df[self.columns]
+
+    def to_arrow(self):
+
+        """
+        Returns the rows as an Arrow table. The questions and the correlation measures are dictionary-encoded and test_result is a nullable boolean.
+        """
+
+        arrays = self.arrays()
+        question_names = pa.array(list(self.questions),type = pa.string())
+        corr_test_names = pa.array(list(self.corr_tests),type = pa.string())
+        test_result = arrays['test_result']
+
+        return pa.table({'question1':pa.DictionaryArray.from_arrays(arrays['question1'],question_names),
+                         'question2':pa.DictionaryArray.from_arrays(arrays['question2'],question_names),
+                         'test_p-value':arrays['test_p-value'],
+                         'test_result':pa.array(test_result == 1,mask = test_result == -1),
+                         'corr':arrays['corr'],
+                         'corr_p-value':arrays['corr_p-value'],
+                         'corr_test':pa.DictionaryArray.from_arrays(arrays['corr_test'],corr_test_names)})
+
+    def write_parquet(self,file_path):
+
+        pq.write_table(self.to_arrow(),file_path)
+
+    def write_feather(self,file_path):
+
+        feather.write_feather(self.to_arrow(),file_path,compression = 'uncompressed')
@@ -0,0 +1,246 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+from multiprocessing import shared_memory
+import json
+import mmap
+import os
+import numpy as np
+import pandas as pd
+
+class SharedSurvey:
+
+    """
+    An encoded survey (the category codes of the qualified columns and the numeric columns, see a_data_process.D.encode_qualified)
+    published once into shared memory or a memory-mapped file, so that worker processes attach to it without copying the data.
+    The block starts with a small JSON header describing the columns, followed by the column buffers.
+    A SharedSurvey behaves like a read-only dict of Series, and pickling it sends only the name of the block, so a worker attaches on unpickling.
+
+    Attributes:
+    -----------
+    name : str
+        The name of the shared memory block, or None for a memory-mapped file.
+    file_path : str
+        The file path to the memory-mapped file, or None for shared memory.
+    header : dict
+        The number of rows and the name, dtype, offset (from the start of the data) and categories of each column.
+    owner : bool
+        Whether this object published the block and removes it on unlink().
+
+    Methods:
+    --------
+    publish(columns, name, file_path):
+        Writes the columns into a new block and returns it attached.
+    keys() / [name]:
+        Returns the names of the columns / a column as a Series sharing the memory of the block.
+    close() / unlink():
+        Detaches from the block / removes it.
+    """
+
+    alignment = 64
+
+    def __init__(self,name = None,file_path = None):
+
+        if (name is None) == (file_path is None):
+            raise ValueError('Give either the name of a shared memory block or the file path to a memory-mapped file.')
+
+        self.name = name
+        self.file_path = file_path
+        self.owner = False
+        self.series = {}
+
+        if name is not None:
+            self.shm = shared_memory.SharedMemory(name = name)
+            self.buffer = self.shm.buf
+
+        else:
+            self.file = open(file_path,'rb')
+            self.mmap = mmap.mmap(self.file.fileno(),0,access = mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mmap)
+
+        header_size = int(np.frombuffer(self.buffer,dtype = '<u8',count = 1)[0])
+        self.header = json.loads(bytes(self.buffer[8:8 + header_size]).decode('utf-8'))
+        self.start = self.data_start(header_size)
+        self.column_info = {column['name']:column for column in self.header['columns']}
+
+    @classmethod
+    def data_start(cls,header_size):
+
+        """
+        Returns the offset of the column buffers after a header of header_size bytes (preceded by its 8-byte size).
+        """
+
+        return -(-(8 + header_size) // cls.alignment) * cls.alignment
+
+    @classmethod
+    def publish(cls,columns,name = None,file_path = None):
+
+        """
+        Writes encoded columns into a new shared memory block (default) or a memory-mapped file.
+
+        Parameters:
+        -----------
+        columns : DataFrame or dict
+            The columns, categorical or numeric, all of the same length.
+        name : str, optional
+            The name of the shared memory block (default is a random name).
+        file_path : str, optional
+            The file path to a memory-mapped file to use instead of shared memory.
+
+        Returns:
+        --------
+        SharedSurvey
+            The published survey, which owns the block.
+        """
+
+        names = list(columns.keys())
+        n_rows = len(columns[names[0]]) if len(names) > 0 else 0
+
+        # lay the columns out after the header
+        header_columns = []
+        buffers = []
+
+        for c in names:
+
+            arr = columns[c]
+
+            if len(arr) != n_rows:
+                raise ValueError('All the columns must have the same length: {}'.format(c))
+
+            if isinstance(arr.dtype, pd.CategoricalDtype):
+                values = np.ascontiguousarray(arr.cat.codes.values)
+                categories = [v.item() if isinstance(v, np.generic) else v for v in arr.cat.categories]
+                header_columns.append({'name':c,'dtype':values.dtype.str,'categories':categories,'ordered':bool(arr.cat.ordered)})
+
+            elif isinstance(arr.dtype, np.dtype) and arr.dtype.kind in 'biuf':
+                values = np.ascontiguousarray(np.asarray(arr))
+                header_columns.append({'name':c,'dtype':values.dtype.str})
+
+            else:
+                raise ValueError('Only categorical and numeric columns can be published, encode the qualified columns first: {}'.format(c))
+
+            buffers.append(values)
+
+        # the offsets are relative to the data, which starts at the first aligned byte after the header
+        offset = 0
+
+        for column, values in zip(header_columns,buffers):
+            column['offset'] = offset
+            offset += -(-values.nbytes // cls.alignment) * cls.alignment
+
+        header_bytes = json.dumps({'n_rows':n_rows,'columns':header_columns}).encode('utf-8')
+        data_start = cls.data_start(len(header_bytes))
+
+        size = max(data_start + offset, 1)
+
+        if file_path is None:
+            shm = shared_memory.SharedMemory(name = name,create = True,size = size)
+            target = shm.buf
+        else:
+            f = open(file_path,'w+b')
+            f.truncate(size)
+            target_mmap = mmap.mmap(f.fileno(),size)
+            target = memoryview(target_mmap)
+
+        target[:8] = np.array([len(header_bytes)],dtype = '<u8').tobytes()
+        target[8:8 + len(header_bytes)] = header_bytes
+
+        for column, values in zip(header_columns,buffers):
+            start = data_start + column['offset']
+            target[start:start + values.nbytes] = values.tobytes()
+
+        if file_path is None:
+            survey = cls(name = shm.name)
+            shm.close()
+        else:
+            target.release()
+            target_mmap.close()
+            f.close()
+            survey = cls(file_path = file_path)
+
+        survey.owner = True
+
+        return survey
+
+    def keys(self):
+
+        return self.column_info.keys()
+
+    def __iter__(self):
+
+        return iter(self.column_info)
+
+    def __len__(self):
+
+        return len(self.column_info)
+
+    def __contains__(self,name):
+
+        return name in self.column_info
+
+    def __getitem__(self,name):
+
+        """
+        Returns a column as a read-only Series sharing the memory of the block.
+        """
+
+        if name not in self.series:
+
+            column = self.column_info[name]
+            values = np.frombuffer(self.buffer,dtype = np.dtype(column['dtype']),count = self.header['n_rows'],offset = self.start + column['offset'])
+            values.flags.writeable = False
+
+            if 'categories' in column:
+                values = pd.Categorical.from_codes(values,dtype = pd.CategoricalDtype(column['categories'],ordered = column['ordered']))
+
+            self.series[name] = pd.Series(values,name = name,copy = False)
+
+        return self.series[name]
+
+    def __reduce__(self):
+
+        # a worker attaches to the block by its name instead of receiving the data
+        return (SharedSurvey,(self.name,self.file_path))
+
+    def close(self):
+
+        """
+        Detaches from the block. The Series returned before must not be used any more.
+        """
+
+        self.series = {}
+
+        if self.name is not None:
+            self.buffer = None
+            self.shm.close()
+        else:
+            self.buffer.release()
+            self.buffer = None
+            self.mmap.close()
+            self.file.close()
+
+    def unlink(self):
+
+        """
+        Removes the block. Only the publisher should call it, after the workers are done.
+        """
+
+        if self.name is not None:
+            shared_memory.SharedMemory(name = self.name).unlink()
+        else:
+            os.remove(self.file_path)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self,*args):
+
+        self.close()
+
+        if self.owner == True:
+            self.unlink()
@@ -0,0 +1,578 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+from collections import Counter
+import numbers
+import numpy as np
+import pandas as pd
+import scipy as sp
+import a_data_process as a
+import correlation_test as ct
+import correlation as cor
+import distribution_test as dit
+import utility as u
+
+class JointCounts:
+
+    """
+    Mergeable co-occurrence counts of the values of two columns.
+    It works as the contingency table of two qualified columns and as the rank buffer of the other pairs.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def update(self,arr1,arr2):
+
+        """
+        Adds the co-occurrences of a chunk.
+        """
+
+        codes1, uniques1 = pd.factorize(arr1)
+        codes2, uniques2 = pd.factorize(arr2)
+
+        cells = np.bincount(codes1.astype(np.int64) * len(uniques2) + codes2, minlength = len(uniques1) * len(uniques2))
+
+        for cell in np.flatnonzero(cells):
+            self.counts[(uniques1[cell // len(uniques2)], uniques2[cell % len(uniques2)])] += int(cells[cell])
+
+    def merge(self,other):
+        self.counts.update(other.counts)
+        return self
+
+    def table(self):
+
+        """
+        Returns the contingency table whose rows and columns are sorted by value.
+        """
+
+        table = pd.Series(self.counts).unstack(fill_value = 0)
+
+        return table.sort_index(axis = 0).sort_index(axis = 1)
+
+class Moments:
+
+    """
+    Mergeable count, means, centered sums of squares and co-moment of two quantified columns (Chan et al.).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(2)
+        self.m2 = np.zeros(2)
+        self.comoment = 0.
+
+    def update(self,arr1,arr2):
+
+        """
+        Adds the moments of a chunk.
+        """
+
+        other = Moments()
+        x = np.column_stack([np.asarray(arr1,dtype = float), np.asarray(arr2,dtype = float)])
+
+        other.n = len(x)
+
+        if other.n > 0:
+            other.mean = x.mean(axis = 0)
+            centered = x - other.mean
+            other.m2 = (centered ** 2).sum(axis = 0)
+            other.comoment = (centered[:,0] * centered[:,1]).sum()
+
+        return self.merge(other)
+
+    def merge(self,other):
+
+        n = self.n + other.n
+
+        if n == 0:
+            return self
+
+        delta = other.mean - self.mean
+
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / n
+        self.comoment = self.comoment + other.comoment + delta[0] * delta[1] * self.n * other.n / n
+        self.mean = self.mean + delta * other.n / n
+        self.n = n
+
+        return self
+
+def average_ranks(counts):
+
+    """
+    Returns the average (tied) rank of each distinct value from its count. The values must be sorted.
+    """
+
+    counts = np.asarray(counts,dtype = float)
+    cumulative = np.cumsum(counts)
+
+    return cumulative - (counts - 1) / 2
+
+def group_moments(table):
+
+    """
+    Returns the count, mean and centered sum of squares of each group from a contingency table (groups on the rows, values on the columns).
+    """
+
+    values = table.columns.values.astype(float)
+    counts = table.values.astype(float)
+
+    n = counts.sum(axis = 1)
+    mean = counts @ values / n
+    m2 = (counts * (values[None,:] - mean[:,None]) ** 2).sum(axis = 1)
+
+    return n, mean, m2
+
+def anova_from_moments(n,mean,m2):
+
+    """
+    One-way ANOVA from the group moments. It gives the same p-value as scipy.stats.f_oneway().
+    """
+
+    k = len(n)
+    total = n.sum()
+    grand_mean = (n * mean).sum() / total
+
+    ss_between = (n * (mean - grand_mean) ** 2).sum()
+    ss_within = m2.sum()
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        f = (ss_between / (k - 1)) / (ss_within / (total - k))
+
+    return sp.stats.f.sf(f, k - 1, total - k)
+
+def kruskal_from_table(table):
+
+    """
+    Kruskal-Wallis H-test with tie correction from a contingency table (groups on the rows, sorted values on the columns).
+    It gives the same p-value as scipy.stats.kruskal().
+    """
+
+    counts = table.values.astype(float)
+    value_counts = counts.sum(axis = 0)
+    total = value_counts.sum()
+
+    ranks = average_ranks(value_counts)
+    rank_sums = counts @ ranks
+    n = counts.sum(axis = 1)
+
+    h = 12 / (total * (total + 1)) * (rank_sums ** 2 / n).sum() - 3 * (total + 1)
+    tie_correction = 1 - ((value_counts ** 3 - value_counts).sum() / (total ** 3 - total))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        h = h / tie_correction
+
+    return sp.stats.chi2.sf(h, len(n) - 1)
+
+def bartlett_from_moments(n,m2):
+
+    """
+    Bartlett's test from the group moments. It gives the same p-value as scipy.stats.bartlett().
+    """
+
+    k = len(n)
+    total = n.sum()
+    var = m2 / (n - 1)
+    pooled_var = ((n - 1) * var).sum() / (total - k)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        numerator = (total - k) * np.log(pooled_var) - ((n - 1) * np.log(var)).sum()
+        denominator = 1 + (1 / (3 * (k - 1))) * ((1 / (n - 1)).sum() - 1 / (total - k))
+
+    return sp.stats.chi2.sf(numerator / denominator, k - 1)
+
+def correlation_p_value(corr,n):
+
+    """
+    Two-sided p-value of a Pearson or Spearman correlation coefficient with the t-distribution (n - 2 degrees of freedom).
+    """
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        t = corr * np.sqrt((n - 2) / ((1 - corr) * (1 + corr)))
+
+    return 2 * sp.stats.t.sf(np.abs(t), n - 2)
+
+def spearman_from_counts(joint_counts):
+
+    """
+    Spearman rank-order correlation from the co-occurrence counts, ranking each distinct value once.
+    """
+
+    table = joint_counts.table()
+    counts = table.values.astype(float)
+
+    ranks1 = average_ranks(counts.sum(axis = 1))
+    ranks2 = average_ranks(counts.sum(axis = 0))
+    total = counts.sum()
+
+    centered1 = ranks1 - (counts.sum(axis = 1) @ ranks1) / total
+    centered2 = ranks2 - (counts.sum(axis = 0) @ ranks2) / total
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        corr = (centered1 @ counts @ centered2) / np.sqrt((counts.sum(axis = 1) @ centered1 ** 2) * (counts.sum(axis = 0) @ centered2 ** 2))
+
+    return corr, correlation_p_value(corr,total), 'Spearman'
+
+def cramers_v_from_counts(joint_counts):
+
+    """
+    Cramer's V from the co-occurrence counts of two qualified columns.
+    """
+
+    return cor.cramers_v_from_table(joint_counts.table().values)
+
+def corr_ratio_from_table(table):
+
+    """
+    Correlation ratio from a contingency table (groups on the rows, values on the columns).
+    """
+
+    n, mean, m2 = group_moments(table)
+    grand_mean = (n * mean).sum() / n.sum()
+
+    all_var = m2.sum() + (n * (mean - grand_mean) ** 2).sum()
+
+    return (all_var - m2.sum()) / all_var
+
+def original_name(column):
+
+    """
+    Returns the column name without the '_duplicated' suffix given by a_data_process.Q.question_combination().
+    """
+
+    return column[:-len('_duplicated')] if column.endswith('_duplicated') else column
+
+class StreamingSweep:
+
+    """
+    Runs the statistical approach of b_stats_approach.main() on a CSV file read in chunks.
+    The full DataFrame is never held in memory: the first pass fits the imputation model from per-column value counts,
+    and the second pass builds mergeable sufficient statistics per column pair.
+
+    Attributes:
+    -----------
+    file_path : str
+        The file path to the CSV file.
+    encode : str
+        The encoding of the CSV file.
+    likert_scale : dict
+        The mapping from answers to scores, e.g. scales.yaml.
+    chunksize : int
+        The number of rows in each chunk.
+    impute_model : ImputeModel
+        The imputation model. It is fitted in the first pass unless given.
+    profiles : dict
+        The 'type' and 'scale' of every column after the imputation.
+
+    Methods:
+    --------
+    fit(columns):
+        Fits the imputation model and the column profiles from per-column value counts.
+
+    accumulate(q_comb):
+        Builds the sufficient statistics of every question pair.
+
+    main(q_comb, threshold):
+        Returns the results in the same layout as b_stats_approach.main().
+    """
+
+    def __init__(self,file_path,encode,likert_scale,chunksize = 500,impute_model = None,missing_allowance = .1,fill_qualified_constant_value = 'Empty'):
+
+        self.file_path = file_path
+        self.encode = encode
+        self.likert_scale = likert_scale
+        self.chunksize = chunksize
+        self.impute_model = impute_model
+        self.missing_allowance = missing_allowance
+        self.fill_qualified_constant_value = fill_qualified_constant_value
+        self.profiles = {}
+
+    def iter_chunks(self,columns,impute = True):
+
+        """
+        Reads the given columns in chunks, strips the column names, and replaces the Likert scale answers.
+        """
+
+        header = pd.read_csv(self.file_path,encoding = self.encode,nrows = 0).columns
+        usecols = [c for c in header if c.strip() in columns]
+
+        for chunk in pd.read_csv(self.file_path,encoding = self.encode,usecols = usecols,chunksize = self.chunksize):
+
+            chunk = chunk.rename(columns = dict(zip(chunk.columns,[c.strip() for c in chunk.columns])))
+            chunk = a.D.replacement(chunk,self.likert_scale)
+
+            if impute == True:
+                chunk = self.impute_model.transform(chunk)
+
+            yield chunk
+
+    def fit(self,columns):
+
+        """
+        Fits the imputation model (unless it was given) and the column profiles from per-column value counts.
+        The value counts are the rank buffers for the median and the most frequent value.
+
+        Parameters:
+        -----------
+        columns : list
+            The columns to be analysed.
+
+        Returns:
+        --------
+        StreamingSweep
+            The object itself.
+        """
+
+        value_counts = {c: Counter() for c in columns}
+        missings = Counter()
+        rows = 0
+
+        for chunk in self.iter_chunks(columns,impute = False):
+
+            rows += len(chunk)
+
+            for c in columns:
+                missings[c] += int(chunk[c].isna().sum())
+                value_counts[c].update(chunk[c].value_counts().to_dict())
+
+        statistics = {}
+
+        for c in columns:
+
+            counts = pd.Series(value_counts[c],dtype = object)
+            is_numeric = all(isinstance(v, numbers.Number) and not isinstance(v, bool) for v in counts.index)
+            missing_ratio = missings[c] / rows
+
+            if is_numeric == True:
+
+                counts = counts.astype(float).sort_index()
+                values = counts.index.values.astype(float)
+                total = counts.sum()
+                mean = (counts.values @ values) / total if total > 0 else np.nan
+                std = np.sqrt((counts.values @ (values - mean) ** 2) / total) if total > 0 else np.nan
+
+                outliers = counts.values[(values < mean - 3 * std) | (values > mean + 3 * std)].sum()
+                outlier_ratio = outliers / rows
+
+                # the median of the expanded values from the cumulative counts
+                cumulative = np.cumsum(counts.values)
+                lower = values[np.searchsorted(cumulative, (total + 1) // 2)] if total > 0 else np.nan
+                upper = values[np.searchsorted(cumulative, total // 2 + 1)] if total > 0 else np.nan
+
+                if missing_ratio > self.missing_allowance and outlier_ratio >= .003: # 0.3%
+                    strategy, fill_value = 'median', (lower + upper) / 2
+                else:
+                    strategy, fill_value = 'mean', mean
+
+                statistics[c] = {'type':'quantified', 'missing_ratio':missing_ratio, 'outlier_ratio':outlier_ratio, 'strategy':strategy, 'fill_value':fill_value}
+
+            else:
+
+                if missing_ratio > self.missing_allowance:
+                    strategy, fill_value = 'constant', self.fill_qualified_constant_value
+                else:
+                    # SimpleImputer breaks ties by the smallest value
+                    strategy, fill_value = 'most_frequent', min(counts.index[counts == counts.max()])
+
+                statistics[c] = {'type':'qualified', 'missing_ratio':missing_ratio, 'outlier_ratio':np.nan, 'strategy':strategy, 'fill_value':fill_value}
+
+        if self.impute_model is None:
+            self.impute_model = a.ImputeModel(self.missing_allowance,self.fill_qualified_constant_value)
+            self.impute_model.statistics = pd.DataFrame.from_dict(statistics,orient = 'index')
+
+        fitted = self.impute_model.statistics
+
+        for c in columns:
+
+            uniques = set(value_counts[c])
+
+            if fitted.loc[c,'strategy'] in ['mean','median']:
+                uniques = set(np.round(np.array(list(uniques),dtype = float),0))
+
+            if missings[c] > 0:
+                fill_value = fitted.loc[c,'fill_value']
+                uniques.add(np.round(fill_value,0) if fitted.loc[c,'strategy'] in ['mean','median'] else fill_value)
+
+            self.profiles[c] = {'type':statistics[c]['type'], 'scale':u.isscale(pd.Series(list(uniques),dtype = float if statistics[c]['type'] == 'quantified' else object),self.likert_scale)}
+
+        return self
+
+    def routes(self,comb_idx):
+
+        """
+        Returns the types and scales of a question pair ordered as arr1 and arr2 in b_stats_approach.main().
+        """
+
+        names = [original_name(comb_idx[1]), original_name(comb_idx[0])]
+
+        arr_types = [self.profiles[c]['type'] for c in names]
+        arr_scales = [self.profiles[c]['scale'] for c in names]
+
+        return names, arr_types, arr_scales
+
+    def accumulate(self,q_comb):
+
+        """
+        Builds the sufficient statistics of every question pair in one pass over the chunks:
+        contingency counts (rank buffers) for the pairs with a qualified or rank column, and moments for the quantified pairs.
+
+        Parameters:
+        -----------
+        q_comb : list
+            A list of question combinations to analyze.
+
+        Returns:
+        --------
+        dict
+            A dictionary mapping each question combination to its 'counts' (JointCounts) and 'moments' (Moments).
+        """
+
+        pair_stats = {}
+
+        for comb_idx in q_comb:
+
+            _, arr_types, arr_scales = self.routes(comb_idx)
+
+            needs_counts = arr_types != ['quantified','quantified'] or 'rank scale' in arr_scales
+            needs_moments = arr_types == ['quantified','quantified']
+
+            pair_stats[comb_idx] = {'counts':JointCounts() if needs_counts else None, 'moments':Moments() if needs_moments else None}
+
+        for chunk in self.iter_chunks(list(self.profiles)):
+
+            for comb_idx, stats in pair_stats.items():
+
+                names, _, _ = self.routes(comb_idx)
+                arr1 = chunk[names[0]]
+                arr2 = chunk[names[1]]
+
+                if stats['counts'] is not None:
+                    stats['counts'].update(arr1,arr2)
+
+                if stats['moments'] is not None:
+                    stats['moments'].update(arr1,arr2)
+
+        return pair_stats
+
+    def qualified_quantified_test(self,table,threshold):
+
+        """
+        Decides and performs the ANOVA or Kruskal-Wallis test from the contingency table (groups on the rows), as b_stats_approach.qualified_quantified_test() does.
+        The Shapiro-Wilk test needs the samples, so each group is expanded from its value counts one at a time.
+        """
+
+        table = table.loc[:,table.columns.sort_values()]
+        n, mean, m2 = group_moments(table)
+
+        observed = [np.repeat(table.columns.values, row.astype(int)) for row in table.values]
+        shapiro_test_result = dit.shapiro_all(observed,False,threshold)
+
+        if shapiro_test_result == True:
+            p = bartlett_from_moments(n,m2)
+            distribution_variance_test_result = [shapiro_test_result, [p, p > threshold]]
+        else:
+            distribution_variance_test_result = [shapiro_test_result, np.nan]
+
+        if distribution_variance_test_result == [True,True]: # one-way-ANOVA
+            p = anova_from_moments(n,mean,m2)
+        elif distribution_variance_test_result == [True,False] or distribution_variance_test_result[0] == False: # kruskal
+            p = kruskal_from_table(table)
+        else: # something wrong
+            return [np.nan,np.nan]
+
+        return [p, p <= threshold]
+
+    def main(self,q_comb,threshold = .05):
+
+        """
+        Conducts the statistical tests and correlation measures of b_stats_approach.main() from the sufficient statistics.
+
+        Parameters:
+        -----------
+        q_comb : list
+            A list of question combinations to analyze.
+        threshold : float
+            The significance level for statistical tests.
+
+        Returns:
+        --------
+        list
+            A list containing the results of the statistical tests and correlation measures for each question combination.
+        """
+
+        q_comb = [tuple(comb_idx) for comb_idx in q_comb]
+        columns = sorted(set(original_name(c) for comb_idx in q_comb for c in comb_idx))
+
+        self.fit(columns)
+        pair_stats = self.accumulate(q_comb)
+
+        result_list = []
+
+        for comb_idx in q_comb:
+
+            _, arr_types, arr_scales = self.routes(comb_idx)
+            counts = pair_stats[comb_idx]['counts']
+            moments = pair_stats[comb_idx]['moments']
+
+            if arr_types == ['qualified','qualified']:
+                table = counts.table()
+                test_result = ct.chi2(table,False,threshold)
+
+            elif arr_types == ['qualified','quantified']:
+                test_result = self.qualified_quantified_test(counts.table(),threshold)
+
+            elif arr_types == ['quantified','qualified']:
+                test_result = self.qualified_quantified_test(counts.table().T,threshold)
+
+            elif arr_types == ['quantified','quantified']:
+                var = moments.m2 / (moments.n - 1)
+                se = var / moments.n
+                t = (moments.mean[0] - moments.mean[1]) / np.sqrt(se.sum())
+                dof = se.sum() ** 2 / (se ** 2 / (moments.n - 1)).sum()
+                p = 2 * sp.stats.t.sf(np.abs(t), dof)
+                test_result = [p, p <= threshold]
+
+            corr_result = self.compute_correlation(arr_types,arr_scales,counts,moments)
+
+            result_list.append(list(comb_idx) + test_result + list(corr_result))
+
+        return result_list
+
+    def compute_correlation(self,arr_types,arr_scales,counts,moments):
+
+        """
+        Decides and computes the correlation measure from the sufficient statistics, as correlation.compute_correlation() does.
+        """
+
+        if arr_types == ['quantified','quantified']:
+
+            if 'rank scale' in arr_scales:
+                return spearman_from_counts(counts)
+
+            corr = np.clip(moments.comoment / np.sqrt(moments.m2[0] * moments.m2[1]), -1, 1)
+
+            return corr, correlation_p_value(corr,moments.n), 'Peason'
+
+        if arr_types == ['qualified','qualified'] and arr_scales == ['nominal scale','nominal scale']:
+            return cramers_v_from_counts(counts), np.NaN, 'Cramers V'
+
+        if arr_types == ['qualified','qualified'] and 'rank scale' in arr_scales and 'ratio scale/ interval scale' not in arr_scales:
+            return spearman_from_counts(counts)
+
+        if arr_types == ['qualified','quantified'] and arr_scales == ['nominal scale','ratio scale/ interval scale']:
+            return corr_ratio_from_table(counts.table()), np.NaN, 'correlation ratio'
+
+        if arr_types == ['quantified','qualified'] and arr_scales == ['ratio scale/ interval scale','nominal scale']:
+            return corr_ratio_from_table(counts.table().T), np.NaN, 'correlation ratio'
+
+        if arr_types == ['qualified','quantified'] and arr_scales in [['nominal scale','rank scale'],['rank scale','rank scale'],['rank scale','ratio scale/ interval scale']]:
+            return spearman_from_counts(counts)
+
+        if arr_types == ['quantified','qualified'] and arr_scales in [['rank scale','nominal scale'],['rank scale','rank scale'],['ratio scale/ interval scale','rank scale']]:
+            return spearman_from_counts(counts)
+
+        return np.NaN,np.NaN, 'Bad request'
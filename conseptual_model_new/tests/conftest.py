@@ -0,0 +1,15 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+import os
+import sys
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the modules import each other by name, and main.py reads parameters.yaml and scales.yaml from the working directory
+sys.path.insert(0,package_dir)
+os.chdir(package_dir)
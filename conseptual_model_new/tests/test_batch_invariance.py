@@ -0,0 +1,132 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+import itertools
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import a_data_process as a
+import config_operation as co
+import correlation as cor
+import correlation_test as ct
+import utility as u
+
+file_paths = [os.path.join('dataset','2020_rws.csv'),os.path.join('dataset','2021_rws.csv')]
+
+@pytest.fixture(scope = 'module')
+def survey():
+
+    likert_scale = co.YamlManager('scales.yaml').read_yaml()
+
+    df = a.D(file_paths[1],'cp1252').del_white_space_col(inplace = True)
+    df = a.D.encode_qualified(a.D.main_impute(a.D.replacement(df,likert_scale),.1,'Empty'))
+
+    return {c:df[c] for c in df.columns if c != 'Response ID' and not df[c].isna().any()}
+
+@pytest.fixture(scope = 'module')
+def model():
+
+    pytest.importorskip('langchain_community')
+    import main as ma
+
+    rws_2020, rws_2021, questions_2020, questions_2021 = ma.load_projected_data(file_paths,ma.questions,['TMS','WPB'])
+    rws_2020 = ma.main_process(rws_2020,ma.likert_scale,encode = True)
+    rws_2021 = ma.main_process(rws_2021,ma.likert_scale,encode = True)
+
+    m = ma.main(['TMS','WPB'],ma.questions,questions_2020,questions_2021,rws_2020,rws_2021)
+    common_q_comb = m.get_common_qs()
+
+    return ma, m, common_q_comb, m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = False)
+
+def assert_same(df1,df2):
+
+    pd.testing.assert_frame_equal(df1.reset_index(drop = True),df2.reset_index(drop = True),check_dtype = False,check_exact = True)
+
+def test_kernels_do_not_depend_on_the_batch(survey):
+
+    qualified = [c for c in survey if u.istype(survey[c]) == 'qualified'][:30]
+    quantified = [c for c in survey if u.istype(survey[c]) == 'quantified'][:30]
+
+    chi2_pairs = list(itertools.combinations(qualified,2))
+    grouped_pairs = list(itertools.product(qualified[:15],quantified[:15]))
+
+    chi2_results = ct.chi2_batch(survey,chi2_pairs,chunk_size = 64)
+    grouped_results = ct.grouped_test_batch(survey,grouped_pairs,chunk_size = 64)
+    ratios = cor.corr_ratio_batch(survey,grouped_pairs,chunk_size = 64)
+    spearman, spearman_p = cor.spearman_matrix(survey,quantified)
+
+    # every pair alone gives the same bits as in the batch
+    for i in range(0,len(chi2_pairs),7):
+        assert_same(chi2_results.iloc[[i]],ct.chi2_batch(survey,[chi2_pairs[i]]))
+
+    for i in range(0,len(grouped_pairs),7):
+        assert_same(grouped_results.iloc[[i]],ct.grouped_test_batch(survey,[grouped_pairs[i]]))
+        assert np.array_equal(ratios.iloc[[i]].values,cor.corr_ratio_batch(survey,[grouped_pairs[i]]).values,equal_nan = True)
+
+    for q1, q2 in itertools.combinations(quantified[::5],2):
+        pair_spearman, pair_spearman_p = cor.spearman_matrix(survey,[q2,q1])
+        assert spearman.at[q1,q2] == pair_spearman.at[q1,q2]
+        assert spearman_p.at[q1,q2] == pair_spearman_p.at[q1,q2]
+
+def test_merged_shards_equal_a_single_run(model,tmp_path):
+
+    ma, m, common_q_comb, collection_df = model
+
+    shard_file_paths = []
+
+    for i in range(3):
+        shard_file_path = ma.shard_file_path(str(tmp_path / 'results'),(i,3))
+        m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = False,shard = (i,3)).to_csv(shard_file_path,index = False)
+        shard_file_paths.append(shard_file_path)
+
+    assert_same(m.merge_shards(shard_file_paths,common_q_comb),collection_df)
+
+    with pytest.raises(ValueError):
+        m.merge_shards(shard_file_paths[:2],common_q_comb)
+
+    with pytest.raises(ValueError):
+        m.merge_shards(shard_file_paths + shard_file_paths[:1],common_q_comb)
+
+def test_workers_equal_a_serial_run(model):
+
+    ma, m, common_q_comb, collection_df = model
+
+    assert_same(m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = False,workers = 4,chunksize = 64),collection_df)
+
+def test_resumed_checkpoint_equals_a_single_run(model,tmp_path):
+
+    import result_cache as rc
+
+    ma, m, common_q_comb, collection_df = model
+    file_path = str(tmp_path / 'checkpoint.jsonl')
+
+    assert_same(m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = False,chunksize = 50,checkpoint = rc.PairResultLog(file_path)),collection_df)
+
+    # a run stopped after a third of the pairs, the last line cut off
+    with open(file_path,'r',encoding = 'utf-8') as f:
+        lines = f.read().split('\n')
+
+    with open(file_path,'w',encoding = 'utf-8') as f:
+        f.write('\n'.join(lines[:len(lines) // 3]) + '\n' + lines[len(lines) // 3][:20])
+
+    assert_same(m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = False,chunksize = 97,checkpoint = rc.PairResultLog(file_path)),collection_df)
+
+def test_printing_profiles_each_column_once(model,monkeypatch):
+
+    import result_cache as rc
+
+    ma, m, common_q_comb, collection_df = model
+
+    calls = []
+    column_fingerprint = rc.column_fingerprint
+    monkeypatch.setattr(rc,'column_fingerprint',lambda arr: calls.append(arr.name) or column_fingerprint(arr))
+
+    printed_df = m.execute(common_q_comb,ma.likert_scale,y = '2021',printing = True)
+
+    assert len(calls) == len(set(calls)) == len(set(collection_df['question1']) | set(collection_df['question2']))
+    pd.testing.assert_frame_equal(printed_df[['question1','question2','corr_test']],collection_df[['question1','question2','corr_test']])
@@ -0,0 +1,49 @@
+"""
+Group 4
+
+Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
+"""
+
+# load libraries
+import runpy
+import sys
+import pandas as pd
+import pytest
+
+@pytest.fixture(scope = 'module')
+def ma():
+
+    pytest.importorskip('langchain_community')
+    import main as ma
+
+    return ma
+
+def run_command_line(monkeypatch,*argv):
+
+    monkeypatch.setattr(sys,'argv',['main.py'] + list(argv))
+    runpy.run_path('main.py',run_name = '__main__')
+
+def expected_results(ma,year):
+
+    # the module-level file paths resolve on every platform
+    rws_2020, rws_2021, questions_2020, questions_2021 = ma.load_projected_data(ma.file_paths,ma.questions,['TMS','WPB'])
+    rws_2020 = ma.main_process(rws_2020,ma.likert_scale,encode = True)
+    rws_2021 = ma.main_process(rws_2021,ma.likert_scale,encode = True)
+
+    m = ma.main(['TMS','WPB'],ma.questions,questions_2020,questions_2021,rws_2020,rws_2021)
+
+    return m.execute(m.get_common_qs(),ma.likert_scale,y = year,printing = False)
+
+@pytest.mark.parametrize('year',['2020','2021'])
+def test_sharded_command_line_runs_merge_into_a_single_run(ma,monkeypatch,tmp_path,year):
+
+    output = str(tmp_path / 'results')
+
+    for i in range(2):
+        run_command_line(monkeypatch,'TMS','WPB','--year',year,'--shard','{}/2'.format(i),'--output',output)
+
+    run_command_line(monkeypatch,'TMS','WPB','--year',year,'--merge',ma.shard_file_path(output,(0,2)),ma.shard_file_path(output,(1,2)),'--output',output)
+
+    merged = pd.read_csv(output + '.csv',float_precision = 'round_trip')
+
+    pd.testing.assert_frame_equal(merged,expected_results(ma,year),check_dtype = False,check_exact = True)
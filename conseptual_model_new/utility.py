@@ -5,8 +5,81 @@ Ryosuke Iimura, DePaul University, School of Computing, RIIMURA@depaul.edu
 """
 
 # load libraries
+import weakref
 import pandas as pd
 import numpy as np
+import config_operation as co
+import result_cache as rc
+
+def category_codes(arr):
+    """
+    Returns the integer codes of a qualified variable and the number of its categories.
+    A categorical Series (see a_data_process.D.encode_qualified) gives its codes as they are, otherwise the values are factorized.
+
+    Parameters:
+    arr : array_like
+        The categorical (qualified) variable.
+
+    Returns:
+    tuple
+        The codes (missing values are coded as -1) and the number of categories.
+    """
+
+    if isinstance(arr.dtype, pd.CategoricalDtype):
+        return arr.cat.codes.values, len(arr.cat.categories)
+
+    codes, uniques = pd.factorize(arr)
+
+    return codes, len(uniques)
+
+def shape_chunks(shapes,chunk_size):
+    """
+    Groups the positions of many pairs by their shape and splits each group into chunks, for the batched kernels.
+    A chunk only holds pairs of the same shape, so nothing is padded and the result of a pair does not depend on the other pairs of its batch,
+    e.g. on how the pairs are split into shards or worker chunks.
+
+    Parameters:
+    shapes : list
+        The shape of each pair, e.g. the numbers of categories of its columns.
+    chunk_size : int
+        The maximum number of pairs in a chunk.
+
+    Returns:
+    list
+        A list of (shape, positions) tuples, the positions being an array of indices into shapes.
+    """
+
+    buckets = {}
+
+    for i, shape in enumerate(shapes):
+        buckets.setdefault(shape, []).append(i)
+
+    return [(shape, np.array(positions[start:start + chunk_size], dtype = int)) for shape, positions in buckets.items() for start in range(0, len(positions), chunk_size)]
+
+def unique_values(arr):
+    """
+    Returns the unique values of an array. A categorical Series is answered from its category table.
+
+    Parameters:
+    arr : array_like
+        The array to check.
+
+    Returns:
+    array_like
+        The unique values observed in the array.
+    """
+
+    if isinstance(arr.dtype, pd.CategoricalDtype):
+        codes = arr.cat.codes.values
+        observed = np.unique(codes)
+        uniques = list(arr.cat.categories[observed[observed >= 0]])
+
+        if observed[0] < 0:
+            uniques.append(np.nan)
+
+        return uniques
+
+    return arr
 
 def array_split(qualified_val,quantified_val):
     """
@@ -21,16 +94,22 @@ def array_split(qualified_val,quantified_val):
     Returns:
     list
         A list of arrays, each representing a subset of quantified values corresponding to a unique qualified value.
+        The arrays are ordered by the first appearance of the qualified values.
     """
 
-    target_qid_two_arrs_df = pd.concat([qualified_val, quantified_val],axis = 1)
+    codes, _ = category_codes(qualified_val)
+    values = np.asarray(quantified_val)
+
+    levels, first_appearance = np.unique(codes, return_index = True)
 
-    arr_list = []
+    # a stable sort keeps the original row order within each group
+    order = np.argsort(codes, kind = 'stable')
+    arr_list = np.split(values[order], np.searchsorted(codes[order], levels[1:]))
 
-    for uv in qualified_val.unique():
-        arr_list.append(target_qid_two_arrs_df.loc[target_qid_two_arrs_df.loc[:,qualified_val.name] == uv,quantified_val.name].values)
+    # missing values never equal to themselves, so their group is empty
+    arr_list = [values[:0] if level < 0 else arr for level, arr in zip(levels, arr_list)]
 
-    return arr_list
+    return [arr_list[i] for i in np.argsort(first_appearance)]
 
 def istype(arr):
     """
@@ -47,7 +126,7 @@ def istype(arr):
     if arr.dtype in [np.int8,np.int16,np.int32,np.int64,np.uint8,np.uint16,np.uint32,np.uint64,np.float16,np.float32,np.float64]:
         return 'quantified'
 
-    elif arr.dtype in [object,bool]:
+    elif arr.dtype in [object,bool] or isinstance(arr.dtype, pd.CategoricalDtype):
         return 'qualified'
 
     else:
@@ -67,7 +146,9 @@ def isscale(arr,likert_scale):
     str
         'rank scale' if the array matches the Likert scale, 'nominal scale' otherwise.
     """
-    if len(set(arr) - set(likert_scale.keys())) == 0 or len(set(arr) - set(likert_scale.values())) == 0 :
+    uniques = set(unique_values(arr))
+
+    if len(uniques - set(likert_scale.keys())) == 0 or len(uniques - set(likert_scale.values())) == 0 :
         return 'rank scale'
     else:
         is_type = istype(arr)
@@ -75,4 +156,189 @@ def isscale(arr,likert_scale):
             return 'nominal scale'
         
         else:
-            return 'ratio scale/ interval scale'
\ No newline at end of file
+            return 'ratio scale/ interval scale'
+
+class ColumnCatalog:
+
+    """
+    A catalog of column profiles computed once per column and read by the statistics layer instead of calling istype() and isscale() for every pair.
+    A column which is not in the catalog yet is profiled on its first lookup. The catalog can be saved into a YAML file to be inspected and reused.
+    The profiles are keyed by the column name and the fingerprint of its data (see result_cache.column_fingerprint),
+    so a column of the same name in another year or file is profiled on its own.
+
+    Attributes:
+    -----------
+    likert_scale : dict
+        The mapping from answers to scores, e.g. scales.yaml.
+    profiles : dict
+        The profiles of each column name keyed by the fingerprint of the data: 'type' (istype), 'scale' (isscale), 'dtype',
+        'cardinality', 'unique_values', 'missing_ratio' and 'likert_coverage' (the ratio of the unique answers found in the Likert scale).
+
+    Methods:
+    --------
+    profile_column(arr, likert_scale):
+        Returns the profile of a column.
+    fingerprint(arr):
+        Returns the fingerprint of a column, hashed once per Series.
+    add(columns, names):
+        Profiles many columns.
+    profile(arr):
+        Returns the profile of a column from the catalog.
+    save(file_path) / load(file_path):
+        Writes the catalog into a YAML file and reads it back.
+    """
+
+    def __init__(self,likert_scale,profiles = None):
+
+        self.likert_scale = likert_scale
+        self.profiles = {} if profiles is None else profiles
+        self.fingerprints = {} # id of a Series --> (weak reference, fingerprint)
+
+    @staticmethod
+    def profile_column(arr,likert_scale):
+
+        """
+        Returns the profile of a column.
+
+        Parameters:
+        -----------
+        arr : pandas.Series
+            The column to profile.
+        likert_scale : dict
+            The mapping from answers to scores.
+
+        Returns:
+        --------
+        dict
+            The profile of the column.
+        """
+
+        uniques = [v.item() if isinstance(v, np.generic) else v for v in unique_values(arr)]
+        answers = [v for v in uniques if not pd.isna(v)]
+
+        if len(answers) > 0:
+            likert_coverage = max(len(set(answers) & set(likert_scale.keys())), len(set(answers) & set(likert_scale.values()))) / len(answers)
+        else:
+            likert_coverage = 0.
+
+        return {
+            'type':istype(arr),
+            'scale':isscale(arr,likert_scale),
+            'dtype':str(arr.dtype),
+            'cardinality':len(answers),
+            'unique_values':uniques,
+            'missing_ratio':float(arr.isna().mean()) if len(arr) > 0 else 0.,
+            'likert_coverage':float(likert_coverage)}
+
+    def add(self,columns,names = None):
+
+        """
+        Profiles many columns. Columns already in the catalog are profiled again.
+
+        Parameters:
+        -----------
+        columns : DataFrame or dict
+            The columns, looked up by name.
+        names : list, optional
+            The names of the columns to profile (default is all the columns).
+
+        Returns:
+        --------
+        ColumnCatalog
+        """
+
+        if names is None:
+            names = list(columns.keys())
+
+        for name in names:
+            self.profiles.setdefault(name,{})[self.fingerprint(columns[name])] = self.profile_column(columns[name],self.likert_scale)
+
+        return self
+
+    def fingerprint(self,arr):
+
+        """
+        Returns the fingerprint of a column. The fingerprint of a Series is memoized as long as the Series exists, so repeated lookups do not hash the data again.
+        """
+
+        memo = self.fingerprints.get(id(arr))
+
+        if memo is not None and memo[0]() is arr:
+            return memo[1]
+
+        fingerprint = rc.column_fingerprint(arr)
+        key = id(arr)
+        self.fingerprints[key] = (weakref.ref(arr,lambda _: self.fingerprints.pop(key,None)), fingerprint)
+
+        return fingerprint
+
+    def __getstate__(self):
+
+        # the memo of fingerprints holds weak references, which are not sent to worker processes
+        state = self.__dict__.copy()
+        state['fingerprints'] = {}
+
+        return state
+
+    def profile(self,arr):
+
+        """
+        Returns the profile of a column from the catalog, profiling it first if the catalog has no profile of its name and data.
+
+        Parameters:
+        -----------
+        arr : pandas.Series
+            The column, looked up by its name and fingerprint.
+
+        Returns:
+        --------
+        dict
+            The profile of the column.
+        """
+
+        profiles = self.profiles.setdefault(arr.name,{})
+        fingerprint = self.fingerprint(arr)
+
+        if fingerprint not in profiles:
+            profiles[fingerprint] = self.profile_column(arr,self.likert_scale)
+
+        return profiles[fingerprint]
+
+    def save(self,file_path):
+
+        """
+        Writes the catalog into a YAML file.
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the YAML file.
+        """
+
+        ym = co.YamlManager(file_path)
+        ym.write_yaml({'likert_scale':dict(self.likert_scale),'profiles':self.profiles})
+
+    @classmethod
+    def load(cls,file_path):
+
+        """
+        Reads a catalog from a YAML file written by save().
+
+        Parameters:
+        -----------
+        file_path : str
+            The file path to the YAML file.
+
+        Returns:
+        --------
+        ColumnCatalog
+            The catalog.
+        """
+
+        ym = co.YamlManager(file_path)
+        data = ym.read_yaml()
+
+        # profiles saved without fingerprints cannot be matched to the data, so they are profiled again
+        profiles = {name:entries for name, entries in data['profiles'].items() if all(isinstance(p, dict) for p in entries.values())}
+
+        return cls(data['likert_scale'],profiles)